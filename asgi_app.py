@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ASGI 版本 - 与 vercel_web_app.py 提供相同的路由
+LLM 流式调用使用 AsyncOpenAI，yt-dlp / 翻译 / 飞书上传放到线程池执行，
+单个进程即可同时承载大量长请求和 SSE 连接。
+
+运行: uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+"""
+
+import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.responses import Response, JSONResponse, StreamingResponse, FileResponse, PlainTextResponse
+from starlette.routing import Route
+from services import ServiceError, workspaces, translate_job, extract_job, search_job, prepare_chat, achat_events
+from static_assets import load_asset
+import metrics
+
+# 阻塞型任务（下载、整片翻译、上传）的线程数上限，与事件循环隔离
+JOB_THREADS = int(os.environ.get("ASGI_JOB_THREADS", 32))
+_job_executor = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix="job")
+
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_job_executor, func, *args)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def error_response(e):
+    status = e.status if isinstance(e, ServiceError) else 500
+    return JSONResponse({'success': False, 'error': str(e)}, status_code=status)
+
+
+async def index(request):
+    asset = load_asset('index.html')
+    if f'"{asset.etag}"' in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers={'ETag': f'"{asset.etag}"'})
+    body, headers = asset.respond(request.headers.get('accept-encoding', ''))
+    return Response(body, headers=headers)
+
+
+async def translate(request):
+    """API端点：处理翻译请求"""
+    try:
+        return JSONResponse(await run_blocking(translate_job, await read_json(request)))
+    except Exception as e:
+        print(f"处理过程中出错: {e}")
+        return error_response(e)
+
+
+async def extract(request):
+    """提取字幕并返回原始文本"""
+    try:
+        return JSONResponse(await run_blocking(extract_job, await read_json(request)))
+    except Exception as e:
+        return error_response(e)
+
+
+async def search(request):
+    """全文搜索已翻译的字幕，命中结果带视频时间点（毫秒）"""
+    try:
+        return JSONResponse(await run_blocking(search_job, request.query_params))
+    except Exception as e:
+        return error_response(e)
+
+
+async def deepseek_chat(request):
+    """根据字幕 ID + 指令，流式返回答案；对话历史保存在服务端"""
+    try:
+        turn = await run_blocking(prepare_chat, await read_json(request))
+    except Exception as e:
+        return error_response(e)
+
+    async def generate():
+        async for event in achat_events(turn):
+            yield f"data: {json.dumps(event)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+async def download_file(request):
+    """文件下载端点：按任务 ID + 文件 ID 定位，流式返回"""
+    resolved = workspaces.resolve_download(request.path_params['job_id'], request.path_params['file_id'])
+    if not resolved:
+        return PlainTextResponse("文件不存在", status_code=404)
+    file_path, download_name, mimetype = resolved
+    return FileResponse(file_path, media_type=mimetype, filename=download_name)
+
+
+async def metrics_endpoint(request):
+    """Prometheus 指标"""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+app = Starlette(routes=[
+    Route('/', index),
+    Route('/api/translate', translate, methods=['POST']),
+    Route('/api/extract', extract, methods=['POST']),
+    Route('/api/search', search),
+    Route('/api/deepseek', deepseek_chat, methods=['POST']),
+    Route('/download/{job_id}/{file_id}', download_file),
+    Route('/metrics', metrics_endpoint),
+])
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='127.0.0.1', port=8000)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+离线批量翻译：不经过 HTTP，直接在多进程中执行 下载 → 翻译 → 发布。
+
+    python backfill.py --urls urls.txt --out backfill/ --workers 4
+    python backfill.py --playlist "https://www.youtube.com/@name/videos" --limit 200 --resume
+    python backfill.py https://youtu.be/xxxxxxxxxxx --feishu
+
+每个视频的结果（状态、耗时、用量、输出文件）追加写入 JSONL 清单；有行翻译失败或
+被预算截断的视频记为 partial。--resume 只跳过清单中状态为 ok 的 URL。任务使用 bulk
+优先级，直接调用 produce_translation，不经过 Web 服务的单飞合并；与 Web 服务共用
+TEMP_DIR 时共享字幕/译文缓存和每日预算。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def read_urls(path):
+    """One URL per line; blank lines and lines starting with # are ignored."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def read_manifest(path):
+    """Returns {url: last record} from an existing manifest."""
+    records = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 上次运行中断时可能留下半行
+                    continue
+                records[record.get("url")] = record
+    except OSError:
+        pass
+    return records
+
+
+def output_name(url, title):
+    from singleflight import video_id_from_url
+    name = video_id_from_url(url) or title or "video"
+    return "".join(c for c in name if c.isalnum() or c in ('-', '_')) + ".md"
+
+
+def run_one(url, deepseek_key, out_dir, feishu=None):
+    """
+    Worker process: translates one video and copies the result to `out_dir`.
+    Never raises. Status is 'ok', 'partial' (some lines failed or were cut
+    by the budget) or 'error'.
+    """
+    from services import ServiceError, produce_translation
+
+    started = time.time()
+    record = {"url": url}
+    try:
+        result = produce_translation(url, deepseek_key, priority='bulk', feishu=feishu)
+        output_path = os.path.abspath(os.path.join(out_dir, output_name(url, result['video_title'])))
+        shutil.copyfile(result['output_path'], output_path)
+        record.update({
+            "status": "partial" if result['failed_lines'] or result['feishu_partial'] else "ok",
+            "title": result['video_title'],
+            "output": output_path,
+            "usage": result['usage'],
+            "reused_lines": result['reused_lines'],
+            "failed_lines": result['failed_lines'],
+            "feishu_node": result['feishu_node'],
+            "feishu_partial": result['feishu_partial'],
+        })
+    except ServiceError as e:
+        record.update({"status": "error", "error": str(e), "http_status": e.status})
+    except Exception as e:
+        record.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    record["seconds"] = round(time.time() - started, 3)
+    record["finished"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translate many videos offline with a process pool")
+    parser.add_argument("urls", nargs="*", help="video URLs")
+    parser.add_argument("--urls", dest="urls_file", help="file with one URL per line")
+    parser.add_argument("--playlist", action="append", default=[], help="channel or playlist URL (repeatable)")
+    parser.add_argument("--limit", type=int, help="newest N videos per playlist (default: all)")
+    parser.add_argument("--out", default="backfill", help="output directory (default: ./backfill)")
+    parser.add_argument("--manifest", help="JSONL manifest (default: <out>/manifest.jsonl)")
+    parser.add_argument("--resume", action="store_true", help="skip URLs already successful in the manifest")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="worker processes")
+    parser.add_argument("--deepseek-key", default=os.environ.get("DEEPSEEK_API_KEY", ""),
+                        help="DeepSeek API key (default: $DEEPSEEK_API_KEY)")
+    parser.add_argument("--feishu", action="store_true",
+                        help="also publish to Feishu ($FEISHU_APP_ID, $FEISHU_APP_SECRET, $FEISHU_SPACE_ID)")
+    args = parser.parse_args()
+
+    if not args.deepseek_key:
+        parser.error("a DeepSeek API key is required (--deepseek-key or $DEEPSEEK_API_KEY)")
+    feishu = None
+    if args.feishu:
+        feishu = {
+            'app_id': os.environ.get("FEISHU_APP_ID"),
+            'app_secret': os.environ.get("FEISHU_APP_SECRET"),
+            'space_id': os.environ.get("FEISHU_SPACE_ID"),
+        }
+        if not all(feishu.values()):
+            parser.error("--feishu requires FEISHU_APP_ID, FEISHU_APP_SECRET and FEISHU_SPACE_ID")
+
+    urls = list(args.urls)
+    if args.urls_file:
+        urls += read_urls(args.urls_file)
+    if args.playlist:
+        from prefetch import list_recent_videos
+        for playlist in args.playlist:
+            urls += [url for _, url in list_recent_videos(playlist, args.limit)]
+    # 去重并保持顺序
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        parser.error("no URLs given")
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.out, "manifest.jsonl")
+    if args.resume:
+        done = {url for url, record in read_manifest(manifest_path).items() if record.get("status") == "ok"}
+        skipped = len(urls)
+        urls = [url for url in urls if url not in done]
+        skipped -= len(urls)
+        if skipped:
+            print(f"跳过已完成的 {skipped} 个视频")
+
+    print(f"共 {len(urls)} 个视频，{args.workers} 个进程")
+    started = time.time()
+    succeeded = partial = failed = 0
+    cost = 0.0
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(run_one, url, args.deepseek_key, args.out, feishu): url for url in urls}
+        try:
+            for future in as_completed(futures):
+                record = future.result()
+                manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                manifest.flush()
+                if record["status"] == "error":
+                    failed += 1
+                else:
+                    if record["status"] == "ok":
+                        succeeded += 1
+                    else:
+                        partial += 1
+                    cost += record["usage"].get("cost_usd", 0)
+                note = record.get('error') or (f"{record['failed_lines']} 行未翻译" if record['status'] == "partial" else "")
+                print(f"[{succeeded + partial + failed}/{len(urls)}] {record['status']} {record['url']} "
+                      f"({record['seconds']}s){' ' + note if note else ''}")
+        except KeyboardInterrupt:
+            print("中断：等待进行中的任务结束，未开始的任务已取消（可用 --resume 继续）")
+            for future in futures:
+                future.cancel()
+            raise
+
+    print(f"完成：成功 {succeeded}，不完整 {partial}，失败 {failed}，花费 ${cost:.4f}，用时 {time.time() - started:.1f}s")
+    print(f"清单: {manifest_path}")
+    return 1 if failed or partial else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
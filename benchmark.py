@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准脚本
+
+  python benchmark.py streams [--concurrency 64] [--workers 4]
+      对比 gunicorn 同步 worker (WSGI) 与 uvicorn (ASGI) 能同时承载的 SSE 流数量。
+      上游 DeepSeek 由本地模拟服务代替，不需要网络和 API 密钥。
+
+  python benchmark.py startup [--repeat 5]
+      测量入口模块的冷启动导入耗时，以及各重量级依赖单独导入的耗时，
+      并检查这些依赖是否在启动阶段被加载。
+
+  python benchmark.py memory [--hours 10]
+      用合成的长直播字幕对比旧的整表处理方式与 CueStore 流式处理的 Python 堆内存峰值。
+      翻译接口由本地假客户端代替。
+
+  python benchmark.py pipeline [--videos 20] [--concurrency 8] [--latency openai=0.8,youtube=1.5]
+      整条流水线（下载 → 翻译 → 写出/飞书）的吞吐量。yt-dlp、翻译接口和飞书都从录像回放
+      （见 cassette.py），可注入延迟和故障，不需要网络。默认使用合成字幕，
+      --cassettes 指定用 CASSETTE_MODE=record 录制的目录。
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class FakeDeepSeekHandler(BaseHTTPRequestHandler):
+    """OpenAI 兼容的最小模拟服务：流式返回固定数量的 chunk，每个 chunk 之间等待 delay 秒"""
+
+    chunks = 40
+    delay = 0.05
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not body.get('stream'):
+            payload = json.dumps({
+                "id": "bench", "object": "chat.completion", "created": 0, "model": body.get("model", ""),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for i in range(self.chunks):
+            chunk = {
+                "id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body.get("model", ""),
+                "choices": [{"index": 0, "delta": {"content": "字"}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_upstream(chunks, delay):
+    FakeDeepSeekHandler.chunks = chunks
+    FakeDeepSeekHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', _free_port()), FakeDeepSeekHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _stream_once(port, body, stats, lock):
+    started = time.time()
+    first_byte = None
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+        conn.request('POST', '/api/deepseek', body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if first_byte is None and b'"delta"' in line:
+                first_byte = time.time()
+                with lock:
+                    stats['active'] += 1
+                    stats['peak'] = max(stats['peak'], stats['active'])
+        conn.close()
+        with lock:
+            stats['ttfb'].append((first_byte or time.time()) - started)
+            stats['total'].append(time.time() - started)
+    except Exception as e:
+        with lock:
+            stats['errors'].append(str(e))
+    finally:
+        if first_byte is not None:
+            with lock:
+                stats['active'] -= 1
+
+
+def run_stream_load(port, concurrency):
+    body = json.dumps({
+        'deepseek_key': 'bench',
+        'instruction': '总结这段字幕',
+        'subtitles': [f"line {i}" for i in range(200)],
+        'mode': 'direct'
+    })
+    stats = {'ttfb': [], 'total': [], 'errors': [], 'active': 0, 'peak': 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=_stream_once, args=(port, body, stats, lock)) for _ in range(concurrency)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats['wall'] = time.time() - started
+    return stats
+
+
+def bench_streams(args):
+    upstream = start_fake_upstream(args.chunks, args.chunk_delay)
+    stream_seconds = args.chunks * args.chunk_delay
+    print(f"模拟上游: 每个流 {args.chunks} 个 chunk，约 {stream_seconds:.1f}s；并发请求数 {args.concurrency}")
+
+    servers = {
+        f'wsgi (gunicorn sync x{args.workers})': lambda port: [
+            sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-k', 'sync',
+            '-b', f'127.0.0.1:{port}', '--timeout', '300', 'vercel_web_app:app'],
+        'asgi (uvicorn x1)': lambda port: [
+            sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1', '--port', str(port),
+            '--log-level', 'warning'],
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = dict(os.environ, DEEPSEEK_BASE_URL=f"http://127.0.0.1:{upstream.server_port}", TEMP_DIR=temp_dir)
+        for name, command in servers.items():
+            port = _free_port()
+            proc = subprocess.Popen(command(port), cwd=REPO_DIR, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                if not _wait_for_port(port):
+                    print(f"{name}: 服务启动失败")
+                    continue
+                stats = run_stream_load(port, args.concurrency)
+            finally:
+                proc.terminate()
+                proc.wait()
+
+            done = len(stats['total'])
+            print(f"\n{name}")
+            print(f"  完成 {done}/{args.concurrency}，失败 {len(stats['errors'])}，总耗时 {stats['wall']:.2f}s")
+            print(f"  同时进行中的流峰值: {stats['peak']}")
+            print(f"  首字延迟 p50 {_percentile(stats['ttfb'], 50):.2f}s  p95 {_percentile(stats['ttfb'], 95):.2f}s")
+            print(f"  完整耗时 p50 {_percentile(stats['total'], 50):.2f}s  p95 {_percentile(stats['total'], 95):.2f}s")
+
+    upstream.shutdown()
+
+
+# 只应在具体路由第一次使用时才加载的依赖
+HEAVY_MODULES = ['yt_dlp', 'openai', 'requests']
+ENTRY_MODULES = ['vercel_web_app', 'asgi_app']
+
+
+def _import_profile(module):
+    """
+    Imports `module` in a fresh interpreter with -X importtime. Returns
+    (wall_seconds, {module: cumulative_seconds}, heavy_loaded) for the
+    module and its direct imports.
+    """
+    code = (
+        "import sys, json, time; t = time.perf_counter(); "
+        f"import {module}; "
+        "print(json.dumps([time.perf_counter() - t, "
+        f"[m for m in {HEAVY_MODULES!r} if m in sys.modules]]))"
+    )
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_DIR,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'import failed')
+    wall, heavy_loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    per_module = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        # 只统计入口模块及其直接导入（importtime 用缩进表示嵌套深度）
+        raw_name = line.split('|')[2]
+        if len(raw_name) - len(raw_name.lstrip(' ')) <= 3:
+            per_module[name] = int(cumulative) / 1e6
+    return wall, per_module, heavy_loaded
+
+
+def bench_startup(args):
+    print(f"冷启动导入耗时（每项 {args.repeat} 次取中位数）")
+    for module in ENTRY_MODULES + HEAVY_MODULES:
+        walls = []
+        breakdown = {}
+        heavy_loaded = []
+        try:
+            for _ in range(args.repeat):
+                wall, breakdown, heavy_loaded = _import_profile(module)
+                walls.append(wall)
+        except RuntimeError as e:
+            print(f"\n{module}: 无法导入 ({e})")
+            continue
+
+        print(f"\n{module}: {_percentile(walls, 50) * 1000:.1f} ms")
+        if module in ENTRY_MODULES:
+            print(f"  启动时已加载的重量级依赖: {', '.join(heavy_loaded) or '无'}")
+            top = sorted(breakdown.items(), key=lambda item: item[1], reverse=True)[:args.top]
+            for name, seconds in top:
+                print(f"  {name:<32} {seconds * 1000:8.1f} ms")
+
+
+class _FakeCompletions:
+    """Echoes every input line with a prefix, like a translator that never fails."""
+
+    def create(self, model, messages, stream=False, **kwargs):
+        from types import SimpleNamespace
+        content = "\n".join(f"译：{line}" for line in messages[-1]['content'].split("\n"))
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+class FakeTranslationClient:
+    def __init__(self):
+        from types import SimpleNamespace
+        self.chat = SimpleNamespace(completions=_FakeCompletions())
+
+
+def write_synthetic_vtt(path, hours):
+    """
+    Writes a YouTube-style auto-caption track: ~2s cues with word-level
+    timing tags, each line shown twice as it scrolls, and recurring phrases.
+    """
+    from cue_store import format_timestamp
+    words = "the quick brown fox jumps over a lazy dog while we talk about model training data".split()
+    cues = int(hours * 3600 / 2)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("WEBVTT\nKind: captions\nLanguage: en\n\n")
+        for i in range(cues):
+            start, end = i * 2000, i * 2000 + 2000
+            n = i // 2
+            line = " ".join(words[(n * 7 + k) % len(words)] for k in range(8)) + f" {n % 5000}"
+            first, *rest = line.split()
+            # 第二次出现时带逐词时间标签，解析后与第一次的文本相同
+            tagged = first + "".join(f"<{format_timestamp(start + k * 200)}><c> {w}</c>" for k, w in enumerate(rest))
+            f.write(f"{format_timestamp(start)} --> {format_timestamp(end)} align:start position:0%\n")
+            f.write(f"{tagged}\n\n" if i % 2 else f"{line}\n\n")
+    return cues
+
+
+def _legacy_translate(path, client):
+    """The pre-CueStore pipeline: all Caption objects, strings, the seen set and the joined result at once."""
+    from cue_store import iter_vtt_cues, format_timestamp
+
+    class Caption:
+        # 与 webvtt-py 的 Caption 一样，每个 cue 一个对象，时间以字符串保存
+        def __init__(self, start, end, text):
+            self.start = start
+            self.end = end
+            self.lines = text.split("\n")
+            self.text = text
+
+    captions = [Caption(format_timestamp(s), format_timestamp(e), t) for s, e, t in iter_vtt_cues(path)]
+    translated_content = []
+    seen_texts = set()
+    caption_batch = []
+    for i, caption in enumerate(captions):
+        text = caption.text.replace('\n', ' ').strip()
+        if not text or text.replace('.', '').replace(':', '').replace(' ', '').isdigit() or text in seen_texts:
+            continue
+        seen_texts.add(text)
+        caption_batch.append(text)
+        if len(caption_batch) >= 20 or i == len(captions) - 1:
+            response = client.chat.completions.create(model="", messages=[{"role": "user", "content": "\n".join(caption_batch)}])
+            for orig, trans in zip(caption_batch, response.choices[0].message.content.split("\n")):
+                translated_content.append(f"> {orig}\n{trans}\n")
+            caption_batch = []
+    return "\n".join([f"<!-- {len(captions)} / {len(seen_texts)} -->"] + translated_content)
+
+
+def bench_memory(args):
+    import tracemalloc
+    from contextlib import redirect_stdout
+    from translator import write_translation
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vtt_path = os.path.join(temp_dir, 'livestream.en.vtt')
+        cues = write_synthetic_vtt(vtt_path, args.hours)
+        size_mb = os.path.getsize(vtt_path) / 1e6
+        print(f"合成字幕: {args.hours} 小时，{cues} 个 cue，{size_mb:.1f} MB")
+
+        client = FakeTranslationClient()
+        results = {}
+
+        devnull = open(os.devnull, 'w')
+        tracemalloc.start()
+        started = time.perf_counter()
+        _legacy_translate(vtt_path, client)
+        results['旧实现 (对象列表 + 整体拼接)'] = (tracemalloc.get_traced_memory()[1], time.perf_counter() - started)
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        with open(os.path.join(temp_dir, 'out.md'), 'w', encoding='utf-8') as out, redirect_stdout(devnull):
+            write_translation(vtt_path, out, 'bench', client=client)
+        results['CueStore + 流式写出'] = (tracemalloc.get_traced_memory()[1], time.perf_counter() - started)
+        tracemalloc.stop()
+        devnull.close()
+
+    print()
+    baseline = None
+    for name, (peak, seconds) in results.items():
+        baseline = baseline or peak
+        print(f"{name:<28} 峰值 {peak / 1e6:8.1f} MB  ({peak / baseline:5.1%})  耗时 {seconds:.2f}s")
+
+
+def bench_pipeline(args):
+    from contextlib import redirect_stdout
+    from concurrent.futures import ThreadPoolExecutor
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # services 在导入时读取 TEMP_DIR，缓存、工作目录和账本都放在临时目录里
+        os.environ['TEMP_DIR'] = temp_dir
+        import metrics
+        from cassette import Cassette, use_cassette
+
+        cassette = Cassette(args.cassettes or os.path.join(temp_dir, 'cassettes'), 'replay',
+                            latency=args.latency, jitter=args.jitter, faults=args.faults, seed=args.seed,
+                            on_miss='synthesize' if args.synthesize or not args.cassettes else 'error')
+        if args.cassettes:
+            urls = cassette.track_urls()
+            if not urls:
+                sys.exit(f"{args.cassettes} 中没有录制的字幕")
+            print(f"录像: {args.cassettes}，{len(urls)} 个视频")
+        else:
+            vtt_path = os.path.join(temp_dir, 'synthetic.en.vtt')
+            cues = write_synthetic_vtt(vtt_path, args.minutes / 60)
+            with open(vtt_path, 'r', encoding='utf-8') as f:
+                vtt = f.read()
+            urls = []
+            for i in range(args.videos):
+                video_id = f"bench{i:06d}"
+                urls.append(f"https://www.youtube.com/watch?v={video_id}")
+                cassette.add_track(urls[-1], video_id, f"Synthetic video {i}", vtt, channel_id="bench")
+            print(f"合成录像: {args.videos} 个视频，每个 {args.minutes} 分钟 ({cues} 个 cue)")
+        print(f"注入延迟: {args.latency or '无'}  抖动: ±{args.jitter:.0%}  故障: {args.faults or '无'}  "
+              f"并发: {args.concurrency}")
+        use_cassette(cassette)
+
+        import services
+        feishu = {'app_id': 'bench', 'app_secret': 'bench', 'space_id': 'bench'} if args.feishu else None
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+
+        def run(url):
+            started = time.perf_counter()
+            try:
+                services.produce_translation(url, 'bench', priority='bulk', feishu=feishu)
+            except Exception as e:
+                with lock:
+                    failures.append(f"{url}: {type(e).__name__}: {e}")
+                return
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+        devnull = open(os.devnull, 'w')
+        started = time.perf_counter()
+        with redirect_stdout(devnull), ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(run, urls))
+        wall = time.perf_counter() - started
+        devnull.close()
+        use_cassette(None)
+
+    print()
+    print(f"完成 {len(latencies)}/{len(urls)} 个视频，用时 {wall:.2f}s，吞吐 {len(latencies) / wall:.2f} 视频/s")
+    print(f"单个视频耗时: p50 {_percentile(latencies, 50):.2f}s  p95 {_percentile(latencies, 95):.2f}s  "
+          f"max {max(latencies, default=0):.2f}s")
+    print(f"翻译请求 {int(metrics.get('translator_requests_total'))} 次")
+    for boundary in ('youtube', 'openai', 'feishu'):
+        counts = {outcome: int(metrics.get('cassette_requests_total', boundary=boundary, outcome=outcome))
+                  for outcome in ('hit', 'miss', 'fault')}
+        print(f"  {boundary:<8} 命中 {counts['hit']}  未录制 {counts['miss']}  注入故障 {counts['fault']}")
+    for failure in failures[:args.show_failures]:
+        print(f"失败: {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YouTube 字幕翻译助手性能基准")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    streams = sub.add_parser('streams', help='WSGI 与 ASGI 的并发 SSE 流容量对比')
+    streams.add_argument('--concurrency', type=int, default=64)
+    streams.add_argument('--workers', type=int, default=4, help='gunicorn 同步 worker 数')
+    streams.add_argument('--chunks', type=int, default=40)
+    streams.add_argument('--chunk-delay', type=float, default=0.05)
+    streams.set_defaults(func=bench_streams)
+
+    startup = sub.add_parser('startup', help='入口模块与重量级依赖的导入耗时')
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--top', type=int, default=10, help='显示耗时最多的前 N 个模块')
+    startup.set_defaults(func=bench_startup)
+
+    memory = sub.add_parser('memory', help='长字幕处理的内存峰值对比')
+    memory.add_argument('--hours', type=float, default=10)
+    memory.set_defaults(func=bench_memory)
+
+    pipeline = sub.add_parser('pipeline', help='回放外部服务的整条流水线吞吐量')
+    pipeline.add_argument('--cassettes', help='录像目录（默认：合成字幕）')
+    pipeline.add_argument('--videos', type=int, default=20, help='合成视频数')
+    pipeline.add_argument('--minutes', type=float, default=30, help='每个合成视频的时长')
+    pipeline.add_argument('--concurrency', type=int, default=8, help='同时处理的视频数')
+    pipeline.add_argument('--latency', default='openai=0.8,youtube=1.5,feishu=0.1',
+                          help='注入延迟（秒），如 "openai=0.8,feishu=0.1" 或单个数值')
+    pipeline.add_argument('--jitter', type=float, default=0.5, help='延迟抖动比例')
+    pipeline.add_argument('--faults', default='', help='注入故障概率，如 "openai=0.02"')
+    pipeline.add_argument('--seed', type=int, default=0)
+    pipeline.add_argument('--synthesize', action='store_true', help='录像中缺少的翻译和飞书请求使用合成响应')
+    pipeline.add_argument('--feishu', action='store_true', help='同时边翻译边写入（回放的）飞书文档')
+    pipeline.add_argument('--show-failures', type=int, default=5)
+    pipeline.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
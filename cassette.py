@@ -0,0 +1,401 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import metrics
+
+# "record"：照常调用 yt-dlp、翻译接口和飞书，并把响应写入录像；"replay"：只从录像回放，不访问网络；留空关闭
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "").lower()
+CASSETTE_DIR = os.environ.get("CASSETTE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes")
+# 回放时注入的延迟（秒）：单个数值作用于所有边界，或按边界指定，例如 "openai=0.8,feishu=0.1,youtube=1.5"
+CASSETTE_LATENCY = os.environ.get("CASSETTE_LATENCY", "")
+# 延迟的随机抖动比例，0.5 表示在 ±50% 内均匀分布
+CASSETTE_JITTER = float(os.environ.get("CASSETTE_JITTER", 0))
+# 回放时注入故障的概率，格式同 CASSETTE_LATENCY，例如 "openai=0.02"
+CASSETTE_FAULTS = os.environ.get("CASSETTE_FAULTS", "")
+# 延迟抖动和故障的随机种子，相同种子得到相同的序列
+CASSETTE_SEED = int(os.environ.get("CASSETTE_SEED", 0))
+# 回放时遇到录像里没有的请求："error" 报错；"synthesize" 生成合成响应（翻译和飞书，用于吞吐实验）
+CASSETTE_ON_MISS = os.environ.get("CASSETTE_ON_MISS", "error")
+
+BOUNDARIES = ("youtube", "openai", "feishu")
+
+# 录制飞书响应时替换掉的凭据字段
+_SECRET_KEYS = {"tenant_access_token", "app_access_token", "access_token", "refresh_token"}
+
+metrics.describe("cassette_requests_total", "Requests handled by the record/replay layer, by boundary and outcome")
+
+
+class CassetteMiss(LookupError):
+    """A replayed request that is not in the cassette."""
+
+
+class InjectedFault(RuntimeError):
+    """A failure injected during replay."""
+
+
+def parse_spec(spec):
+    """'0.5' -> 0.5 for every boundary; 'openai=0.8,feishu=0.1' -> {'openai': 0.8, 'feishu': 0.1}."""
+    if isinstance(spec, dict):
+        return dict(spec)
+    values = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        name, sep, value = part.rpartition("=")
+        name = name.strip()
+        if not sep:
+            values.update({boundary: float(value) for boundary in BOUNDARIES})
+        elif name in BOUNDARIES:
+            values[name] = float(value)
+        else:
+            raise ValueError(f"unknown boundary: {name}")
+    return values
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {k: "replay-token" if k in _SECRET_KEYS else _redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        hit = getattr(details, "cached_tokens", 0) if details else 0
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "prompt_cache_hit_tokens": hit or 0,
+    }
+
+
+def _completion(recorded):
+    message = SimpleNamespace(role="assistant", content=recorded["content"])
+    choice = SimpleNamespace(index=0, message=message, finish_reason=recorded.get("finish_reason", "stop"))
+    usage = SimpleNamespace(**recorded["usage"]) if recorded.get("usage") else None
+    return SimpleNamespace(choices=[choice], usage=usage)
+
+
+def _synthesize_completion(messages):
+    from usage import estimate_tokens
+    # 逐行回显，行数与原文一致，翻译对齐逻辑照常工作
+    lines = messages[-1]["content"].split("\n")
+    content = "\n".join(f"译：{line}" for line in lines)
+    return {
+        "content": content,
+        "usage": {
+            "prompt_tokens": sum(estimate_tokens(m["content"]) for m in messages),
+            "completion_tokens": estimate_tokens(content),
+            "prompt_cache_hit_tokens": 0,
+        },
+    }
+
+
+class _Response:
+    """The part of requests.Response that feishu_uploader uses."""
+
+    def __init__(self, status_code, body=None, text=None):
+        self.status_code = status_code
+        self._body = body
+        self.text = text if text is not None else json.dumps(body, ensure_ascii=False)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        if self._body is None:
+            raise ValueError("response has no JSON body")
+        return self._body
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise RuntimeError(f"{self.status_code} Error (replayed)")
+
+
+class Cassette:
+    """
+    Records or replays the responses of the external services the pipeline
+    calls: yt-dlp subtitle downloads and playlist listings, OpenAI-compatible
+    chat completions, and Feishu open API requests. Each boundary keeps one
+    JSON file per request key under `root/<boundary>/`; a key recorded
+    several times replays its responses in order, then repeats the last.
+
+    Keys are the URL for yt-dlp, model + messages for completions, and
+    method + URL path for Feishu (access tokens in responses are redacted).
+
+    In replay mode nothing touches the network. Each request first sleeps
+    the configured latency for its boundary (± jitter) and fails with the
+    configured probability: a download returns None, a completion raises
+    InjectedFault, a Feishu request gets an HTTP 500. Requests missing from
+    the cassette raise CassetteMiss, or with on_miss="synthesize" get a
+    synthetic completion (each line echoed) or Feishu success response.
+    """
+
+    def __init__(self, root=CASSETTE_DIR, mode="replay", latency=CASSETTE_LATENCY, jitter=CASSETTE_JITTER,
+                 faults=CASSETTE_FAULTS, seed=CASSETTE_SEED, on_miss=CASSETTE_ON_MISS):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"unknown cassette mode: {mode}")
+        self.root = root
+        self.mode = mode
+        self.latency = parse_spec(latency)
+        self.jitter = jitter
+        self.faults = parse_spec(faults)
+        self.on_miss = on_miss
+        self._random = {boundary: random.Random(f"{seed}-{boundary}") for boundary in BOUNDARIES}
+        self._entries = {}
+        self._cursors = {}
+        self._synthetic = 0
+        self._lock = threading.Lock()
+
+    def _path(self, boundary, key):
+        return os.path.join(self.root, boundary, f"{key}.json")
+
+    def _load(self, boundary, key):
+        # 调用方持有 self._lock
+        if (boundary, key) not in self._entries:
+            try:
+                with open(self._path(boundary, key), "r", encoding="utf-8") as f:
+                    self._entries[boundary, key] = json.load(f)
+            except FileNotFoundError:
+                return None
+        return self._entries[boundary, key]
+
+    def _record(self, boundary, key, request, response):
+        with self._lock:
+            entry = self._load(boundary, key) or {"request": request, "responses": []}
+            entry["responses"].append(response)
+            self._entries[boundary, key] = entry
+            path = self._path(boundary, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, path)
+        metrics.inc("cassette_requests_total", boundary=boundary, outcome="recorded")
+
+    def _next(self, boundary, key):
+        with self._lock:
+            entry = self._load(boundary, key)
+            if entry is None:
+                metrics.inc("cassette_requests_total", boundary=boundary, outcome="miss")
+                return None
+            i = self._cursors.get((boundary, key), 0)
+            self._cursors[boundary, key] = i + 1
+        metrics.inc("cassette_requests_total", boundary=boundary, outcome="hit")
+        responses = entry["responses"]
+        return responses[min(i, len(responses) - 1)]
+
+    def _inject(self, boundary):
+        """Sleeps the injected latency; returns True if this request should fail."""
+        rng = self._random[boundary]
+        with self._lock:
+            delay = self.latency.get(boundary, 0) * (1 + self.jitter * rng.uniform(-1, 1))
+            fault = rng.random() < self.faults.get(boundary, 0)
+        if delay > 0:
+            time.sleep(delay)
+        if fault:
+            metrics.inc("cassette_requests_total", boundary=boundary, outcome="fault")
+        return fault
+
+    def _synthetic_id(self):
+        with self._lock:
+            self._synthetic += 1
+            return self._synthetic
+
+    # ---- yt-dlp ----
+
+    def track_urls(self):
+        """URLs of all recorded subtitle tracks."""
+        urls = []
+        try:
+            names = sorted(os.listdir(os.path.join(self.root, "youtube")))
+        except FileNotFoundError:
+            return urls
+        for name in names:
+            if name.endswith(".json"):
+                with open(os.path.join(self.root, "youtube", name), "r", encoding="utf-8") as f:
+                    request = json.load(f)["request"]
+                if "url" in request:
+                    urls.append(request["url"])
+        return urls
+
+    def add_track(self, url, video_id, title, vtt, channel_id=None):
+        """Adds a subtitle track for `url` without downloading it (synthetic benchmarks)."""
+        self._record("youtube", _digest(["track", url]), {"url": url}, {
+            "id": video_id, "title": title, "channel_id": channel_id,
+            "filename": f"{video_id}.en.vtt", "vtt": vtt,
+        })
+
+    def fetch_track(self, url, output_dir, cookie_file, fetch):
+        """downloader.fetch_subtitle_track through the cassette; `fetch` does the real download."""
+        key = _digest(["track", url])
+        if self.mode == "record":
+            track = fetch(url, output_dir, cookie_file)
+            if track:
+                with open(track['path'], "r", encoding="utf-8") as f:
+                    vtt = f.read()
+                self._record("youtube", key, {"url": url}, {
+                    "id": track['id'], "title": track['title'], "channel_id": track['channel_id'],
+                    "filename": os.path.basename(track['path']), "vtt": vtt,
+                })
+            return track
+
+        if self._inject("youtube"):
+            print(f"下载字幕时出错: injected fault ({url})")
+            return None
+        recorded = self._next("youtube", key)
+        if recorded is None:
+            raise CassetteMiss(f"no recorded subtitle track for {url}")
+        path = os.path.join(output_dir, recorded["filename"])
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(recorded["vtt"])
+        return {'path': path, 'id': recorded["id"], 'title': recorded["title"], 'channel_id': recorded["channel_id"]}
+
+    def list_videos(self, source, limit, fetch):
+        """prefetch.list_recent_videos through the cassette; `fetch` does the real listing."""
+        key = _digest(["list", source, limit])
+        if self.mode == "record":
+            videos = fetch(source, limit)
+            self._record("youtube", key, {"source": source, "limit": limit}, [list(v) for v in videos])
+            return videos
+
+        if self._inject("youtube"):
+            print(f"读取来源失败 {source}: injected fault")
+            return []
+        recorded = self._next("youtube", key)
+        if recorded is None:
+            raise CassetteMiss(f"no recorded listing for {source}")
+        return [tuple(v) for v in recorded]
+
+    # ---- OpenAI ----
+
+    def openai_client(self, api_key=None, base_url=None):
+        """A client exposing `chat.completions.create`; only record mode creates a real OpenAI client."""
+        live = None
+        if self.mode == "record":
+            from openai import OpenAI
+            live = OpenAI(api_key=api_key, base_url=base_url)
+        return SimpleNamespace(chat=SimpleNamespace(completions=_CassetteCompletions(self, live)))
+
+    # ---- Feishu ----
+
+    def requests(self):
+        """Stands in for the `requests` module in feishu_uploader."""
+        return _CassetteRequests(self)
+
+
+class _CassetteCompletions:
+    def __init__(self, cassette, live):
+        self._cassette = cassette
+        self._live = live
+
+    def create(self, **kwargs):
+        if kwargs.get("stream"):
+            raise ValueError("streamed completions are not recorded")
+        request = {"model": kwargs.get("model"), "messages": kwargs.get("messages")}
+        key = _digest(request)
+        cassette = self._cassette
+        if cassette.mode == "record":
+            response = self._live.chat.completions.create(**kwargs)
+            cassette._record("openai", key, request, {
+                "content": response.choices[0].message.content,
+                "finish_reason": getattr(response.choices[0], "finish_reason", None) or "stop",
+                "usage": _usage_dict(getattr(response, "usage", None)),
+            })
+            return response
+
+        if cassette._inject("openai"):
+            raise InjectedFault("injected completion failure")
+        recorded = cassette._next("openai", key)
+        if recorded is None:
+            if cassette.on_miss != "synthesize":
+                raise CassetteMiss(f"no recorded completion for request {key}")
+            recorded = _synthesize_completion(request["messages"])
+        return _completion(recorded)
+
+
+class _CassetteRequests:
+    def __init__(self, cassette):
+        self._cassette = cassette
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        path = urlsplit(url).path
+        key = _digest([method, path])
+        cassette = self._cassette
+        if cassette.mode == "record":
+            import requests
+            response = requests.request(method, url, **kwargs)
+            try:
+                body = _redact(response.json())
+            except ValueError:
+                body = None
+            cassette._record("feishu", key, {"method": method, "path": path}, {
+                "status": response.status_code, "json": body, "text": None if body is not None else response.text,
+            })
+            return response
+
+        if cassette._inject("feishu"):
+            return _Response(500, {"code": 99991400, "msg": "injected fault"})
+        recorded = cassette._next("feishu", key)
+        if recorded is None:
+            if cassette.on_miss != "synthesize":
+                raise CassetteMiss(f"no recorded Feishu response for {method} {path}")
+            n = cassette._synthetic_id()
+            recorded = {"status": 200, "json": {
+                "code": 0, "msg": "success", "tenant_access_token": "replay-token", "expire": 7200,
+                "data": {"node": {"node_token": f"replay-node-{n}", "obj_token": f"replay-doc-{n}"},
+                         "file_token": f"replay-file-{n}"},
+            }}
+        return _Response(recorded["status"], recorded.get("json"), recorded.get("text"))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def active_cassette():
+    """The cassette set with use_cassette() or configured by CASSETTE_MODE, or None."""
+    global _active
+    if _active is None and CASSETTE_MODE:
+        with _active_lock:
+            if _active is None:
+                _active = Cassette(CASSETTE_DIR, CASSETTE_MODE)
+    return _active
+
+
+def use_cassette(cassette):
+    """Routes the external boundaries through `cassette` (None turns record/replay off again)."""
+    global _active
+    _active = cassette
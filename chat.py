@@ -0,0 +1,247 @@
+import os
+
+CHAT_MODEL = os.environ.get("CHAT_MODEL", "deepseek-chat")
+# 历史对话超过该字符数时，把较早的轮次压缩成摘要
+HISTORY_MAX_CHARS = int(os.environ.get("CHAT_HISTORY_MAX_CHARS", 12000))
+# 压缩时原样保留最近的轮次数（一问一答算一轮）
+HISTORY_KEEP_TURNS = int(os.environ.get("CHAT_HISTORY_KEEP_TURNS", 2))
+
+# 字幕超过该字符数时，auto 模式改用分块 map-reduce
+MAP_REDUCE_THRESHOLD_CHARS = int(os.environ.get("MAP_REDUCE_THRESHOLD_CHARS", 60000))
+MAP_WINDOW_CHARS = int(os.environ.get("MAP_WINDOW_CHARS", 20000))
+MAP_WINDOW_OVERLAP_LINES = int(os.environ.get("MAP_WINDOW_OVERLAP_LINES", 5))
+MAP_CONCURRENCY = int(os.environ.get("MAP_CONCURRENCY", 4))
+
+CHAT_MODES = ('auto', 'direct', 'map_reduce')
+
+# 系统提示词前缀必须保持稳定：DeepSeek 的上下文缓存按消息前缀命中，
+# 因此字幕放在最前面，选中内容和指令只放在最后一条 user 消息里。
+SYSTEM_PROMPT_PREFIX = (
+    "你是专业字幕助手。请严格按照用户指令处理下方字幕，"
+    "直接输出结果，不要多余解释。字幕内容如下：\n\n"
+)
+
+MAP_PROMPT = (
+    "你是专业字幕助手。下面是一个长视频字幕中的第 {index}/{total} 段。"
+    "请只根据这一段内容执行用户指令，输出可供后续合并的中间结果，"
+    "保留关键信息和先后顺序，不要写开场白。字幕片段如下：\n\n"
+)
+
+REDUCE_PROMPT = (
+    "你是专业字幕助手。一个长视频的字幕已被分段处理，下面按时间顺序给出各段的中间结果。"
+    "请把它们合并成对用户指令的最终回答：去掉重复，保持顺序，直接输出结果，不要多余解释。"
+    "各段结果如下：\n\n"
+)
+
+SUMMARY_PROMPT = (
+    "请把下面这段用户与字幕助手的对话压缩成简洁的要点摘要，"
+    "保留用户的偏好、已确认的结论和未完成的问题，不要编造内容。"
+)
+
+
+def build_system_prompt(lines):
+    return SYSTEM_PROMPT_PREFIX + "\n".join(lines)
+
+
+def build_user_message(instruction, selection=None):
+    if selection:
+        return f"以下是我选中的字幕片段：\n{selection}\n\n指令：{instruction}"
+    return instruction
+
+
+def build_messages(lines, conversation, user_message):
+    """
+    Assembles the request so that everything before the new user message is
+    byte-identical to the previous turn and can be served from prompt cache.
+    """
+    messages = [{"role": "system", "content": build_system_prompt(lines)}]
+    if conversation.get("summary"):
+        messages.append({"role": "system", "content": f"此前对话摘要：\n{conversation['summary']}"})
+    for turn in conversation.get("turns", []):
+        messages.append({"role": "user", "content": turn["user"]})
+        messages.append({"role": "assistant", "content": turn["assistant"]})
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def turns_from_history(history):
+    """Converts the legacy client-side `history` list into stored turns."""
+    turns = []
+    pending = None
+    for item in history if isinstance(history, list) else []:
+        if not isinstance(item, dict):
+            continue
+        role = item.get('role')
+        content = item.get('content')
+        if not isinstance(content, str) or not content.strip():
+            continue
+        if role == 'user':
+            pending = content
+        elif role == 'assistant' and pending is not None:
+            turns.append({"user": pending, "assistant": content})
+            pending = None
+    return turns
+
+
+def _history_chars(conversation):
+    return len(conversation.get("summary", "")) + sum(
+        len(turn["user"]) + len(turn["assistant"]) for turn in conversation.get("turns", [])
+    )
+
+
+def compact_history(client, conversation):
+    """
+    Folds all but the last HISTORY_KEEP_TURNS turns into the running summary
+    once the history grows past HISTORY_MAX_CHARS. Returns a new dict; the
+    input is left untouched. On API errors the history is kept as is.
+    """
+    turns = conversation.get("turns", [])
+    if _history_chars(conversation) <= HISTORY_MAX_CHARS or len(turns) <= HISTORY_KEEP_TURNS:
+        return conversation
+
+    old_turns = turns[:-HISTORY_KEEP_TURNS] if HISTORY_KEEP_TURNS else turns
+    recent_turns = turns[len(old_turns):]
+    transcript = []
+    if conversation.get("summary"):
+        transcript.append(f"[已有摘要]\n{conversation['summary']}")
+    for turn in old_turns:
+        transcript.append(f"用户：{turn['user']}\n助手：{turn['assistant']}")
+
+    try:
+        response = client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": "\n\n".join(transcript)}
+            ],
+            stream=False
+        )
+        summary = response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"压缩对话历史失败: {e}")
+        return conversation
+
+    compacted = dict(conversation)
+    compacted["summary"] = summary
+    compacted["turns"] = list(recent_turns)
+    return compacted
+
+
+def choose_mode(lines, requested='auto', selection=None):
+    """
+    Picks 'direct' or 'map_reduce'. An explicit mode wins; in auto mode the
+    whole-transcript instructions switch to map-reduce past the threshold.
+    """
+    if requested in ('direct', 'map_reduce'):
+        return requested
+    if selection:
+        return 'direct'
+    total_chars = sum(len(line) + 1 for line in lines)
+    return 'map_reduce' if total_chars > MAP_REDUCE_THRESHOLD_CHARS else 'direct'
+
+
+def split_windows(lines, max_chars=MAP_WINDOW_CHARS, overlap=MAP_WINDOW_OVERLAP_LINES):
+    """
+    Splits the transcript into windows of at most `max_chars` characters.
+    Consecutive windows share `overlap` lines so nothing is cut mid-thought.
+    Returns a list of (first_line_index, window_lines).
+    """
+    windows = []
+    start = 0
+    while start < len(lines):
+        end = start
+        size = 0
+        while end < len(lines) and (end == start or size + len(lines[end]) + 1 <= max_chars):
+            size += len(lines[end]) + 1
+            end += 1
+        windows.append((start, lines[start:end]))
+        if end >= len(lines):
+            break
+        start = max(end - overlap, start + 1)
+    return windows
+
+
+def _map_window(client, window_lines, index, total, instruction):
+    response = client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[
+            {"role": "system", "content": MAP_PROMPT.format(index=index, total=total) + "\n".join(window_lines)},
+            {"role": "user", "content": instruction}
+        ],
+        stream=False
+    )
+    return response.choices[0].message.content.strip()
+
+
+def iter_map_results(client, lines, instruction, concurrency=MAP_CONCURRENCY):
+    """
+    Runs the map step over all windows concurrently. Yields
+    (done_count, total, partials) after each window finishes; `partials`
+    is the ordered list of results, None for windows still in flight.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    windows = split_windows(lines)
+    total = len(windows)
+    partials = [None] * total
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, total))) as executor:
+        futures = {
+            executor.submit(_map_window, client, window_lines, index + 1, total, instruction): index
+            for index, (_, window_lines) in enumerate(windows)
+        }
+        done = 0
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                partials[index] = future.result()
+            except Exception as e:
+                print(f"分段 {index + 1}/{total} 处理失败: {e}")
+                partials[index] = "[该段处理失败]"
+            done += 1
+            yield done, total, partials
+
+
+async def _amap_window(client, window_lines, index, total, instruction):
+    response = await client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[
+            {"role": "system", "content": MAP_PROMPT.format(index=index, total=total) + "\n".join(window_lines)},
+            {"role": "user", "content": instruction}
+        ],
+        stream=False
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def aiter_map_results(client, lines, instruction, concurrency=MAP_CONCURRENCY):
+    """Async twin of iter_map_results for an AsyncOpenAI client."""
+    import asyncio
+
+    windows = split_windows(lines)
+    total = len(windows)
+    partials = [None] * total
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(index, window_lines):
+        async with semaphore:
+            try:
+                return index, await _amap_window(client, window_lines, index + 1, total, instruction)
+            except Exception as e:
+                print(f"分段 {index + 1}/{total} 处理失败: {e}")
+                return index, "[该段处理失败]"
+
+    tasks = [run(index, window_lines) for index, (_, window_lines) in enumerate(windows)]
+    done = 0
+    for next_result in asyncio.as_completed(tasks):
+        index, partial = await next_result
+        partials[index] = partial
+        done += 1
+        yield done, total, partials
+
+
+def build_reduce_messages(partials, conversation, user_message):
+    """Same layout as build_messages, with the partial results in place of the transcript."""
+    sections = [f"【第 {i + 1} 段】\n{partial}" for i, partial in enumerate(partials)]
+    messages = build_messages([], conversation, user_message)
+    messages[0] = {"role": "system", "content": REDUCE_PROMPT + "\n\n".join(sections)}
+    return messages
@@ -0,0 +1,161 @@
+import re
+from array import array
+
+_TIMESTAMP_RE = re.compile(r"(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{3})")
+_TAG_RE = re.compile(r"<[^>]*>")
+
+
+def parse_timestamp(value):
+    """'01:02:03.456' or '02:03.456' -> milliseconds. Returns None if malformed."""
+    match = _TIMESTAMP_RE.match(value.strip())
+    if not match:
+        return None
+    hours, minutes, seconds, millis = match.groups()
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(millis)
+
+
+def format_timestamp(ms):
+    hours, rest = divmod(ms, 3600000)
+    minutes, rest = divmod(rest, 60000)
+    seconds, millis = divmod(rest, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{millis:03d}"
+
+
+def iter_vtt_cues(path):
+    """
+    Streams (start_ms, end_ms, text) from a WebVTT file without building the
+    whole caption list. Inline tags (YouTube's <c> and word timestamps) are
+    stripped and multi-line cue text is joined with newlines, like
+    webvtt-py's Caption.text.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        start = end = None
+        text_lines = []
+        skipping = False
+        for raw in f:
+            line = raw.rstrip("\r\n")
+            if not line.strip():
+                if start is not None:
+                    yield start, end, "\n".join(text_lines)
+                start = end = None
+                text_lines = []
+                skipping = False
+                continue
+            if skipping:
+                continue
+            if start is None:
+                if "-->" in line:
+                    left, right = line.split("-->", 1)
+                    start = parse_timestamp(left)
+                    end = parse_timestamp(right.strip().split(" ")[0])
+                    if start is None or end is None:
+                        start = end = None
+                        skipping = True
+                elif line.startswith(("WEBVTT", "NOTE", "STYLE", "REGION")):
+                    skipping = True
+                # 其他情况为 cue 标识行，忽略
+                continue
+            text_lines.append(_TAG_RE.sub("", line))
+        if start is not None:
+            yield start, end, "\n".join(text_lines)
+
+
+class TextTable:
+    """
+    Append-only table of distinct strings. Each string is stored once,
+    UTF-8 encoded, in a single bytearray addressed by an offsets array;
+    lookups go through a hash index so the str objects are not retained.
+    """
+
+    __slots__ = ("_offsets", "_buffer", "_index")
+
+    def __init__(self):
+        self._offsets = array("q", [0])
+        self._buffer = bytearray()
+        # hash(text) -> text id；极少见的哈希碰撞时存放 id 列表
+        self._index = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def text(self, text_id):
+        return self._buffer[self._offsets[text_id]:self._offsets[text_id + 1]].decode("utf-8")
+
+    def intern(self, text):
+        """Returns the id of `text`, storing it if it is new. Second value is True when new."""
+        key = hash(text)
+        found = self._index.get(key)
+        candidates = found if isinstance(found, list) else ([] if found is None else [found])
+        for text_id in candidates:
+            if self.text(text_id) == text:
+                return text_id, False
+
+        text_id = len(self)
+        self._buffer += text.encode("utf-8")
+        self._offsets.append(len(self._buffer))
+        if found is None:
+            self._index[key] = text_id
+        else:
+            self._index[key] = candidates + [text_id]
+        return text_id, True
+
+
+class CueStore:
+    """
+    Compact, append-only store for the cues of one transcript.
+
+    Per cue only three machine ints are kept (start ms, end ms, text id) in
+    parallel arrays; the distinct texts live in a TextTable.
+    """
+
+    __slots__ = ("starts", "ends", "text_ids", "texts", "raw_count")
+
+    def __init__(self):
+        # 读取到的原始 cue 数（包括被 keep 丢弃的）
+        self.raw_count = 0
+        self.starts = array("q")
+        self.ends = array("q")
+        self.text_ids = array("l")
+        self.texts = TextTable()
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def unique_count(self):
+        return len(self.texts)
+
+    def text(self, text_id):
+        return self.texts.text(text_id)
+
+    def add(self, start_ms, end_ms, text):
+        text_id, _ = self.texts.intern(text)
+        self.starts.append(start_ms)
+        self.ends.append(end_ms)
+        self.text_ids.append(text_id)
+        return text_id
+
+    def iter_cues(self):
+        """Yields (start_ms, end_ms, text_id) in cue order."""
+        return zip(self.starts, self.ends, self.text_ids)
+
+    def iter_unique(self):
+        """Yields (text_id, text) for every distinct text in first-occurrence order."""
+        for text_id in range(self.unique_count):
+            yield text_id, self.text(text_id)
+
+    @classmethod
+    def from_vtt(cls, path, keep=None):
+        """
+        Builds a store from a VTT file. `keep(text)` returns the cleaned text
+        to store, or None to drop the cue.
+        """
+        store = cls()
+        for start, end, text in iter_vtt_cues(path):
+            store.raw_count += 1
+            if keep is not None:
+                text = keep(text)
+                if text is None:
+                    continue
+            store.add(start, end, text)
+        return store
@@ -0,0 +1,321 @@
+import os
+import re
+import unicodedata
+import zlib
+from array import array
+
+# MinHash 估计的相似度达到该值才视为同一句（越高越保守）
+NEAR_DUP_THRESHOLD = float(os.environ.get("DEDUPE_NEAR_THRESHOLD", 0.8))
+# 近似匹配还要求词集合的 Jaccard 相似度达到该值（字符 4-gram 相近但用词不同的不合并）
+NEAR_DUP_WORD_THRESHOLD = float(os.environ.get("DEDUPE_NEAR_WORD_THRESHOLD", 0.6))
+# 相邻字幕末尾最多相差几个词时视为同一句的滚动版本
+PREFIX_MAX_EXTRA_WORDS = int(os.environ.get("DEDUPE_PREFIX_MAX_EXTRA_WORDS", 2))
+# 每个 LSH 桶只比较最近加入的这么多个单元，避免高频句式把查找变成平方复杂度
+NEAR_DUP_MAX_CANDIDATES = int(os.environ.get("DEDUPE_MAX_CANDIDATES", 16))
+
+FILLER_WORDS = {"um", "umm", "uh", "uhh", "uh-huh", "er", "erm", "ah", "hmm", "mm", "mhm"}
+
+SHINGLE_SIZE = 4
+NUM_PERM = 24
+BANDS = 6
+ROWS = NUM_PERM // BANDS
+# 单次哈希 MinHash：每个 shingle 只算一次 crc32，按余数分到 NUM_PERM 个桶里各取最小值；
+# crc32 不加盐，不同进程里签名一致
+_EMPTY = 1 << 32
+_ROTATION = 0x9E3779B1
+
+_NO_SIGNATURE = array("H", [0]) * NUM_PERM
+
+_BRACKETED_RE = re.compile(r"\[[^\]]*\]|\([^)]*\)|♪+")
+_SPACE_RE = re.compile(r"\s+")
+_DIGIT_RE = re.compile(r"\d")
+
+
+def normalize(text):
+    """
+    Canonical form used for matching: lower case, no bracketed sound tags
+    ([Music], (applause)), no filler words, no punctuation or symbols.
+    Returns '' for lines that carry no speech.
+    """
+    text = _BRACKETED_RE.sub(" ", text.lower())
+    text = "".join(" " if unicodedata.category(c)[0] in "PSC" else c for c in text)
+    words = [w for w in _SPACE_RE.split(text) if w and w not in FILLER_WORDS]
+    return " ".join(words)
+
+
+def _signature(normalized):
+    compact = normalized.replace(" ", "").encode("utf-8")
+    bins = [_EMPTY] * NUM_PERM
+    for i in range(max(1, len(compact) - SHINGLE_SIZE + 1)):
+        value = zlib.crc32(compact[i:i + SHINGLE_SIZE])
+        slot = value % NUM_PERM
+        if value < bins[slot]:
+            bins[slot] = value
+    # 每个值只保留低 16 位（b-bit MinHash），误判一致的概率约 1/65536
+    signature = array("H", [value & 0xFFFF for value in bins])
+    for slot in range(NUM_PERM):
+        # 空桶借用右侧第一个非空桶的值（旋转加密），并按距离区分，避免两句都为空的桶被算作一致
+        distance = 0
+        while bins[(slot + distance) % NUM_PERM] == _EMPTY:
+            distance += 1
+        if distance:
+            signature[slot] = (bins[(slot + distance) % NUM_PERM] + distance * _ROTATION) & 0xFFFF
+    return signature
+
+
+def _word_hashes(words):
+    return array("I", {hash(w) & 0xFFFFFFFF for w in words})
+
+
+def _numbers_key(words):
+    # 数字不同（第 45 页 / 第 46 页）意思就不同，近似匹配要求数字完全一致
+    return hash(tuple(w for w in words if _DIGIT_RE.search(w)))
+
+
+class _IntTable:
+    """
+    Open-addressing hash table from 64-bit hashes to non-negative ints,
+    kept in two flat arrays instead of a dict of int objects.
+    """
+
+    __slots__ = ("_keys", "_values", "_used")
+
+    def __init__(self, expected=0):
+        # 负载不超过 2/3，线性探测仍然很短
+        capacity = max(1024, expected * 3 // 2 + 1)
+        self._keys = array("q", [0]) * capacity   # 0 表示空槽
+        self._values = array("i", [-1]) * capacity
+        self._used = 0
+
+    def _slot(self, key):
+        keys = self._keys
+        capacity = len(keys)
+        slot = key % capacity
+        while keys[slot] and keys[slot] != key:
+            slot = slot + 1 if slot + 1 < capacity else 0
+        return slot
+
+    def get(self, key):
+        """Returns the value stored for `key`, or -1."""
+        return self._values[self._slot(key or 1)]
+
+    def put(self, key, value):
+        """Stores `value` for `key`; returns the value it replaces (-1 if none)."""
+        key = key or 1
+        slot = self._slot(key)
+        previous = self._values[slot]
+        if not self._keys[slot]:
+            self._keys[slot] = key
+            self._used += 1
+        self._values[slot] = value
+        if self._used * 3 > len(self._keys) * 2:
+            self._grow()
+        return previous
+
+    def _grow(self):
+        keys, values = self._keys, self._values
+        self._keys = array("q", [0]) * (len(keys) * 2)
+        self._values = array("i", [-1]) * (len(keys) * 2)
+        for key, value in zip(keys, values):
+            if key:
+                slot = self._slot(key)
+                self._keys[slot] = key
+                self._values[slot] = value
+
+
+class DedupeIndex:
+    """
+    Maps caption texts to canonical units, online.
+
+    A text joins an existing unit when its normalized form is identical,
+    or when their one-permutation MinHash signatures (character 4-gram shingles,
+    LSH banded) agree on at least NEAR_DUP_THRESHOLD of the positions,
+    their word sets have a Jaccard similarity of at least
+    NEAR_DUP_WORD_THRESHOLD and they contain exactly the same numbers.
+    The numbers are part of the LSH band key, and only the
+    NEAR_DUP_MAX_CANDIDATES most recent units of a bucket are compared.
+    The longest variant seen becomes the unit's canonical text.
+
+    Normalized strings are only kept as hashes in flat arrays, so the
+    index stays small on multi-hour transcripts; `expected` (the number
+    of texts that will be added) pre-sizes its hash tables.
+    """
+
+    def __init__(self, expected=0):
+        self.canonical = []          # unit id -> canonical text (or the caller's ref for it)
+        self._lengths = array("l")   # unit id -> length of the normalized canonical text
+        self.word_counts = array("l")  # unit id -> number of words in the normalized canonical text
+        self._signatures = array("H")  # NUM_PERM 16-bit MinHash values per unit, back to back (zeros for very short lines)
+        self._word_hashes = array("I")  # 32-bit word hashes of all units, back to back
+        self._word_offsets = array("l", [0])  # unit id -> its slice of _word_hashes (empty for very short lines)
+        self._numbers = array("q")   # unit id -> hash of the number tokens
+        self._exact = _IntTable(expected)  # hash(normalized text) -> unit id
+        self._bands = _IntTable(expected * BANDS)  # hash(band, numbers, band rows) -> newest unit in the bucket
+        self._band_next = array("i")  # unit id * BANDS + band -> next older unit in the same bucket
+
+    def __len__(self):
+        return len(self.canonical)
+
+    def add(self, text, ref=None):
+        """
+        Returns the unit id for `text`, or None if it contains no speech.
+        `ref` (e.g. a CueStore text id) is stored as canonical instead of the text.
+        """
+        normalized = normalize(text)
+        if not normalized:
+            return None
+        canonical = text if ref is None else ref
+
+        unit = self._exact.get(hash(normalized))
+        if unit < 0:
+            unit = None
+        words = normalized.split(" ")
+        signature = word_hashes = None
+        numbers = _numbers_key(words)
+        if unit is None and len(normalized) >= 2 * SHINGLE_SIZE:
+            signature = _signature(normalized)
+            word_hashes = _word_hashes(words)
+            unit = self._match_near(normalized, signature, word_hashes, numbers)
+
+        if unit is None:
+            unit = len(self.canonical)
+            self.canonical.append(canonical)
+            self._lengths.append(len(normalized))
+            self.word_counts.append(len(words))
+            self._signatures.extend(signature if signature is not None else _NO_SIGNATURE)
+            if word_hashes is not None:
+                self._word_hashes.extend(word_hashes)
+            self._word_offsets.append(len(self._word_hashes))
+            self._numbers.append(numbers)
+            for band in range(BANDS):
+                if signature is None:
+                    self._band_next.append(-1)
+                else:
+                    self._band_next.append(self._bands.put(self._band_key(signature, band, numbers), unit))
+        elif len(normalized) > self._lengths[unit]:
+            # 更完整的版本作为翻译用的规范文本
+            self.canonical[unit] = canonical
+            self._lengths[unit] = len(normalized)
+            self.word_counts[unit] = len(words)
+
+        self._exact.put(hash(normalized), unit)
+        return unit
+
+    @staticmethod
+    def _band_key(signature, band, numbers):
+        # 数字不同的句子落在不同的桶里，不必逐个比较
+        return hash((band, numbers, signature[band * ROWS:(band + 1) * ROWS].tobytes()))
+
+    def _match_near(self, normalized, signature, word_hashes, numbers):
+        seen = set()
+        for band in range(BANDS):
+            unit = self._bands.get(self._band_key(signature, band, numbers))
+            for _ in range(NEAR_DUP_MAX_CANDIDATES):
+                if unit < 0:
+                    break
+                candidate, unit = unit, self._band_next[unit * BANDS + band]
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if self._is_near(candidate, normalized, signature, word_hashes, numbers):
+                    return candidate
+        return None
+
+    def _is_near(self, unit, normalized, signature, word_hashes, numbers):
+        if self._numbers[unit] != numbers:
+            return False
+        length = self._lengths[unit]
+        if min(length, len(normalized)) < 0.8 * max(length, len(normalized)):
+            return False
+        offset = unit * NUM_PERM
+        agree = sum(1 for i in range(NUM_PERM) if signature[i] == self._signatures[offset + i])
+        if agree < NEAR_DUP_THRESHOLD * NUM_PERM:
+            return False
+        other_words = self._word_hashes[self._word_offsets[unit]:self._word_offsets[unit + 1]]
+        shared = len(set(word_hashes).intersection(other_words))
+        return shared >= NEAR_DUP_WORD_THRESHOLD * (len(word_hashes) + len(other_words) - shared)
+
+
+def _extends(longer, shorter):
+    """True when word list `longer` is `shorter` plus 1..PREFIX_MAX_EXTRA_WORDS trailing words."""
+    extra = len(longer) - len(shorter)
+    return 0 < extra <= PREFIX_MAX_EXTRA_WORDS and len(shorter) >= 3 and longer[:len(shorter)] == shorter
+
+
+def _merge_rolling(store, canonical, unit_of, word_counts):
+    """
+    Folds a unit into its longer neighbour when, at every place it occurs
+    in cue order, it is a rolling partial of the cue right before or after
+    it ("we are going to" -> "we are going to lose"). A unit that also
+    occurs on its own, or rolls into different lines, keeps its own
+    translation. Returns (canonical, unit_of) renumbered in order.
+    """
+    count = len(canonical)
+    rolls_into = array("l", [-1]) * count
+    standalone = bytearray(count)
+    cached = {}
+
+    def words(unit):
+        if unit not in cached:
+            if len(cached) > 2:
+                cached.clear()
+            cached[unit] = normalize(store.text(canonical[unit])).split(" ")
+        return cached[unit]
+
+    def link(shorter, longer):
+        if rolls_into[shorter] in (-1, longer):
+            rolls_into[shorter] = longer
+            return True
+        standalone[shorter] = 1
+        return False
+
+    previous, previous_rolled = -1, False
+    for _, _, text_id in store.iter_cues():
+        unit = unit_of[text_id]
+        if unit < 0 or unit == previous:
+            continue
+        rolled = False
+        if previous >= 0:
+            gap = word_counts[unit] - word_counts[previous]
+            # 先用词数筛掉绝大多数相邻对，再比较词序列
+            if 0 < gap <= PREFIX_MAX_EXTRA_WORDS and _extends(words(unit), words(previous)):
+                previous_rolled = link(previous, unit) or previous_rolled
+            elif 0 < -gap <= PREFIX_MAX_EXTRA_WORDS and _extends(words(previous), words(unit)):
+                rolled = link(unit, previous)
+            if not previous_rolled:
+                standalone[previous] = 1
+        previous, previous_rolled = unit, rolled
+    if previous >= 0 and not previous_rolled:
+        standalone[previous] = 1
+
+    renumbered = array("l", [-1]) * count
+    kept = array("l")
+    for unit in range(count):
+        if rolls_into[unit] < 0 or standalone[unit]:
+            renumbered[unit] = len(kept)
+            kept.append(canonical[unit])
+    for unit in range(count):
+        target = unit
+        while renumbered[target] < 0:
+            target = rolls_into[target]
+        renumbered[unit] = renumbered[target]
+    return kept, array("l", [-1 if unit < 0 else renumbered[unit] for unit in unit_of])
+
+
+def build_units(store):
+    """
+    Assigns every distinct text of a CueStore to a unit. Returns
+    (canonical, unit_of): canonical[unit] is the store text id of the
+    unit's canonical text, unit_of[text_id] the unit id, or -1 for texts
+    without speech. Exact and near duplicates share a unit anywhere in
+    the transcript; rolling partials only when they are adjacent (see
+    _merge_rolling). The index itself is dropped once the units are known.
+    """
+    index = DedupeIndex(expected=store.unique_count)
+    unit_of = array("l")
+    for text_id, text in store.iter_unique():
+        unit = index.add(text, ref=text_id)
+        unit_of.append(-1 if unit is None else unit)
+    canonical, word_counts = array("l", index.canonical), index.word_counts
+    del index
+    return _merge_rolling(store, canonical, unit_of, word_counts)
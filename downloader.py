@@ -1,12 +1,19 @@
-import yt_dlp
 import os
 import glob
+from cassette import active_cassette
 
-def download_subtitles(url, output_dir=".", cookie_file=None):
+def fetch_subtitle_track(url, output_dir=".", cookie_file=None):
     """
     Downloads subtitles from a YouTube URL using yt-dlp.
-    Returns the path to the downloaded .vtt file.
+    Returns {'path', 'id', 'title', 'channel_id'} or None on failure.
+    Recorded or replayed when a cassette is active (see cassette.py).
     """
+    cassette = active_cassette()
+    if cassette is not None:
+        return cassette.fetch_track(url, output_dir, cookie_file, _download_track)
+    return _download_track(url, output_dir, cookie_file)
+
+def _download_track(url, output_dir, cookie_file):
     ydl_opts = {
         'skip_download': True,
         'writesubtitles': True,
@@ -24,10 +31,13 @@ def download_subtitles(url, output_dir=".", cookie_file=None):
 
     print(f"正在下载字幕: {url}")
     try:
+        # yt-dlp 导入很慢，只在真正下载时加载
+        import yt_dlp
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=True)
             video_id = info['id']
             video_title = info['title']
+            channel_id = info.get('channel_id') or info.get('uploader_id')
             print(f"视频标题: {video_title}")
             
             # 查找下载的 vtt 文件
@@ -36,15 +46,25 @@ def download_subtitles(url, output_dir=".", cookie_file=None):
             
             if not files:
                 print("未找到字幕文件。")
-                return None, None
+                return None
             
             subtitle_file = files[0]
             print(f"字幕已下载: {subtitle_file}")
-            return subtitle_file, video_title
+            return {'path': subtitle_file, 'id': video_id, 'title': video_title, 'channel_id': channel_id}
 
     except Exception as e:
         print(f"下载字幕时出错: {e}")
+        return None
+
+def download_subtitles(url, output_dir=".", cookie_file=None):
+    """
+    Downloads subtitles from a YouTube URL using yt-dlp.
+    Returns (vtt_path, video_title), or (None, None) on failure.
+    """
+    track = fetch_subtitle_track(url, output_dir, cookie_file)
+    if not track:
         return None, None
+    return track['path'], track['title']
 
 if __name__ == "__main__":
     # 测试
@@ -1,5 +1,16 @@
-import requests
+import os
 import json
+import time
+from cassette import active_cassette
+
+def _requests():
+    cassette = active_cassette()
+    if cassette is not None:
+        # 录制/回放飞书响应（见 cassette.py）
+        return cassette.requests()
+    # requests 延迟导入，只有启用飞书上传的请求才需要
+    import requests
+    return requests
 
 def get_tenant_access_token(app_id, app_secret):
     """
@@ -13,7 +24,7 @@ def get_tenant_access_token(app_id, app_secret):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = _requests().post(url, headers=headers, json=data)
         response.raise_for_status()
         return response.json().get("tenant_access_token")
     except Exception as e:
@@ -52,7 +63,7 @@ def create_wiki_node(space_id, title, content, token):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = _requests().post(url, headers=headers, json=data)
         response.raise_for_status()
         res_json = response.json()
         
@@ -162,7 +173,7 @@ def upload_file_to_wiki(space_id, file_path, title, token):
         # Let's try empty.
         
         try:
-            resp = requests.post(url_upload, headers=headers_upload, data=data, files=files)
+            resp = _requests().post(url_upload, headers=headers_upload, data=data, files=files)
             resp_json = resp.json()
             if resp_json.get("code") != 0:
                 print(f"File Upload Error: {resp_json.get('msg')}")
@@ -185,7 +196,7 @@ def upload_file_to_wiki(space_id, file_path, title, token):
                 "title": title
             }
             
-            resp_wiki = requests.post(url_wiki, headers=headers_wiki, json=data_wiki)
+            resp_wiki = _requests().post(url_wiki, headers=headers_wiki, json=data_wiki)
             res_wiki_json = resp_wiki.json()
             
             if res_wiki_json.get("code") != 0:
@@ -198,3 +209,73 @@ def upload_file_to_wiki(space_id, file_path, title, token):
         except Exception as e:
             print(f"Error uploading to wiki: {e}")
             return None
+
+class FeishuDocAppender:
+    """
+    Writes a translation into a new Feishu docx wiki node while it is being
+    produced: `create()` makes the empty document, then `append()` adds
+    entries as paragraph blocks, at most MAX_BLOCKS per request.
+
+    Entries are plain strings (headings, notes) or (original, translation)
+    pairs; the original is written in italics. API errors raise
+    RuntimeError so the caller can fall back to a file upload.
+    """
+
+    MAX_BLOCKS = 50
+    # 同一文档的写入频率限制，请求之间至少间隔这么久
+    MIN_INTERVAL = 0.35
+
+    def __init__(self, space_id, title, token):
+        self.space_id = space_id
+        self.title = title
+        self.token = token
+        self.node_token = None
+        self.document_id = None
+        self._last_request = 0.0
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type": "application/json; charset=utf-8"
+        }
+
+    def create(self):
+        url = f"https://open.feishu.cn/open-apis/wiki/v2/spaces/{self.space_id}/nodes"
+        data = {"obj_type": "docx", "node_type": "origin", "title": self.title}
+        res_json = _requests().post(url, headers=self._headers(), json=data).json()
+        if res_json.get("code") != 0:
+            raise RuntimeError(f"Wiki Node Error: {res_json.get('msg')}")
+        node = res_json.get("data", {}).get("node", {})
+        self.node_token = node.get("node_token")
+        self.document_id = node.get("obj_token")
+        print(f"Created Wiki Doc: {self.title} (Token: {self.document_id})")
+        return self.node_token
+
+    @staticmethod
+    def _text_block(content, italic=False):
+        text_run = {"content": content}
+        if italic:
+            text_run["text_element_style"] = {"italic": True}
+        return {"block_type": 2, "text": {"elements": [{"text_run": text_run}]}}
+
+    def append(self, entries):
+        blocks = []
+        for entry in entries:
+            if isinstance(entry, str):
+                blocks.append(self._text_block(entry))
+            else:
+                original, translation = entry
+                blocks.append(self._text_block(original, italic=True))
+                blocks.append(self._text_block(translation))
+
+        url = (f"https://open.feishu.cn/open-apis/docx/v1/documents/{self.document_id}"
+               f"/blocks/{self.document_id}/children?document_revision_id=-1")
+        for i in range(0, len(blocks), self.MAX_BLOCKS):
+            wait = self.MIN_INTERVAL - (time.monotonic() - self._last_request)
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request = time.monotonic()
+            res_json = _requests().post(url, headers=self._headers(),
+                                        json={"children": blocks[i:i + self.MAX_BLOCKS], "index": -1}).json()
+            if res_json.get("code") != 0:
+                raise RuntimeError(f"Docx Append Error: {res_json.get('msg')}")
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import threading
+
+import metrics
+
+GLOSSARY_DIR = os.environ.get("GLOSSARY_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "glossaries")
+# 所有频道共用的术语表文件名（不含 .json）
+DEFAULT_GLOSSARY = "_default"
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+metrics.describe("glossary_terms_matched_total", "Glossary terms found in translation batches")
+metrics.describe("glossary_patches_total", "Translated lines rewritten to the glossary rendering")
+metrics.describe("glossary_misses_total", "Translated lines still missing a matched term's rendering")
+
+
+def _fold(text):
+    # 逐字符小写，保证下标与原文一一对应（个别字符小写后会变长）
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def _is_word_char(c):
+    return c.isascii() and (c.isalnum() or c == "_")
+
+
+def _term_pattern(term, target):
+    """
+    Regex for one rendering of a term in a translated line. Latin edges only
+    match at word boundaries, as in Glossary.find; a variant that is a
+    truncation of the target (克劳 for 克劳德) must not run on into
+    another letter, so 克劳迪 is left alone.
+    """
+    pattern = re.escape(term)
+    if _is_word_char(term[0]):
+        pattern = r"(?<![A-Za-z0-9_])" + pattern
+    elif term != target and term in target and not target.startswith(term):
+        pattern = r"(?<!\w)" + pattern
+    if _is_word_char(term[-1]):
+        pattern += r"(?![A-Za-z0-9_])"
+    elif term != target and term in target and not target.endswith(term):
+        pattern += r"(?!\w)"
+    return pattern
+
+
+class Glossary:
+    """
+    Term list of one channel, compiled into an Aho–Corasick automaton so a
+    batch is scanned once regardless of the glossary size.
+
+    Entries are {'source', 'target', 'variants'}: `target` is the required
+    rendering, `variants` are known wrong renderings that are rewritten to it.
+    Matching is case-insensitive; Latin terms only match whole words.
+    """
+
+    def __init__(self, entries):
+        self.entries = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._patch_res = []
+        for entry in entries:
+            source = (entry.get("source") or "").strip()
+            target = (entry.get("target") or "").strip()
+            if not source or not target:
+                continue
+            self.entries.append({
+                "source": source,
+                "target": target,
+                "variants": [v for v in entry.get("variants", []) if v and v != target],
+            })
+            self._insert(_fold(source), len(self.entries) - 1)
+            # 目标译法本身也参与匹配（最长优先），包含在其中的变体不会被改写
+            renderings = sorted({target, source, *self.entries[-1]["variants"]}, key=len, reverse=True)
+            self._patch_res.append(re.compile(
+                "|".join(_term_pattern(r, target) for r in renderings), re.IGNORECASE
+            ))
+        self._build()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _insert(self, key, entry_id):
+        state = 0
+        for c in key:
+            nxt = self._goto[state].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][c] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(key), entry_id))
+
+    def _build(self):
+        # 按 BFS 顺序计算失败指针，第一层直接指向根
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for c, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                if state:
+                    self._fail[nxt] = self._goto[fail].get(c, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text):
+        """Returns non-overlapping (start, end, entry_id) matches, leftmost-longest first."""
+        if not self.entries:
+            return []
+        folded = _fold(text)
+        found = []
+        state = 0
+        for i, c in enumerate(folded):
+            while state and c not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(c, 0)
+            for length, entry_id in self._out[state]:
+                start, end = i - length + 1, i + 1
+                if _is_word_char(folded[start]) and start > 0 and _is_word_char(folded[start - 1]):
+                    continue
+                if _is_word_char(folded[end - 1]) and end < len(folded) and _is_word_char(folded[end]):
+                    continue
+                found.append((start, end, entry_id))
+
+        found.sort(key=lambda m: (m[0], m[0] - m[1]))
+        matches = []
+        last_end = 0
+        for start, end, entry_id in found:
+            if start >= last_end:
+                matches.append((start, end, entry_id))
+                last_end = end
+        return matches
+
+    def match_batch(self, lines):
+        """Entry ids found in any of `lines`, in order of first appearance."""
+        seen = {}
+        for line in lines:
+            for _, _, entry_id in self.find(line):
+                seen.setdefault(entry_id, None)
+        if seen:
+            metrics.inc("glossary_terms_matched_total", len(seen))
+        return list(seen)
+
+    def prompt(self, entry_ids):
+        """Instruction listing only the matched terms; '' when nothing matched."""
+        if not entry_ids:
+            return ""
+        terms = "\n".join(f"{self.entries[i]['source']} => {self.entries[i]['target']}" for i in entry_ids)
+        return f"Use these fixed translations for the following terms:\n{terms}"
+
+    def patch(self, source_line, translated_line):
+        """
+        Rewrites `translated_line` so every term found in `source_line` uses
+        its glossary rendering: known variants and untranslated copies of the
+        source term are replaced. Deterministic; never calls the model.
+        """
+        for _, _, entry_id in self.find(source_line):
+            entry = self.entries[entry_id]
+            target = entry["target"]
+            if target in translated_line:
+                continue
+            patched = self._patch_res[entry_id].sub(lambda _: target, translated_line)
+            if target in patched:
+                metrics.inc("glossary_patches_total")
+                translated_line = patched
+            else:
+                metrics.inc("glossary_misses_total")
+        return translated_line
+
+
+def _load_entries(data):
+    # 支持 {"source": "target"} 的简写和 {"terms": [{"source", "target", "variants"}]} 两种格式
+    if isinstance(data, dict) and isinstance(data.get("terms"), list):
+        return data["terms"]
+    if isinstance(data, dict):
+        return [{"source": k, "target": v} for k, v in data.items() if isinstance(v, str)]
+    return []
+
+
+class GlossaryStore:
+    """
+    Per-channel glossaries stored as `<root>/<channel_id>.json`, plus
+    `_default.json` for terms shared by every channel. Files are only
+    re-read when they change.
+    """
+
+    def __init__(self, root=GLOSSARY_DIR):
+        self.root = root
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _read(self, name):
+        if not name or not _NAME_RE.match(name):
+            return []
+        path = os.path.join(self.root, f"{name}.json")
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return []
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = _load_entries(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"⚠️  术语表 {path} 读取失败: {e}")
+            entries = []
+        with self._lock:
+            self._cache[name] = (mtime, entries)
+        return entries
+
+    def for_channel(self, channel_id):
+        """Glossary for `channel_id` (channel terms win over shared ones). None if empty."""
+        entries = {}
+        for entry in self._read(DEFAULT_GLOSSARY) + self._read(channel_id):
+            entries[_fold(entry.get("source") or "")] = entry
+        if not entries:
+            return None
+        return Glossary(entries.values())
@@ -0,0 +1,248 @@
+import os
+import time
+import types
+import threading
+from collections import deque
+
+import metrics
+
+# 默认关闭；开启后批次请求超过自适应阈值仍未返回时，再发一个重复请求，先到先用
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "").lower() in ("1", "true", "yes")
+# 阈值取最近批次耗时的该分位数
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 0.9))
+# 阈值下限（秒），以及样本不足时不对冲
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 2.0))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+# 最近 HEDGE_WINDOW 个请求中对冲请求所占比例的上限
+HEDGE_MAX_RATE = float(os.environ.get("HEDGE_MAX_RATE", 0.1))
+HEDGE_WINDOW = int(os.environ.get("HEDGE_WINDOW", 200))
+# 同时在途的额外请求（对冲请求及尚未结束的落败请求）上限，超出全局调度并发的部分不超过该值
+HEDGE_MAX_IN_FLIGHT = int(os.environ.get("HEDGE_MAX_IN_FLIGHT", 2))
+# 开启对冲时每个请求的超时（秒），落败的请求不会无限占用线程
+HEDGE_REQUEST_TIMEOUT = float(os.environ.get("HEDGE_REQUEST_TIMEOUT", 120))
+# 可选的备用 OpenAI 兼容端点；未设置时对冲请求发往同一端点
+HEDGE_BASE_URL = os.environ.get("HEDGE_BASE_URL", "")
+HEDGE_API_KEY = os.environ.get("HEDGE_API_KEY", "")
+HEDGE_MODEL = os.environ.get("HEDGE_MODEL", "")
+
+metrics.describe("hedge_requests_total", "Hedged translation requests, by outcome")
+metrics.describe("hedge_threshold_seconds", "Current latency threshold after which a batch is hedged")
+metrics.describe("hedge_rate", "Share of recent translation requests that were hedges")
+metrics.describe("hedge_in_flight", "Extra translation requests running because of hedging")
+
+
+class HedgePolicy:
+    """
+    Process-wide hedging state: recent primary latencies (for the p90
+    threshold), recent hedge decisions (for the rate cap) and the number
+    of extra requests in flight (for the concurrency cap).
+    """
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, min_delay=HEDGE_MIN_DELAY, min_samples=HEDGE_MIN_SAMPLES,
+                 max_rate=HEDGE_MAX_RATE, window=HEDGE_WINDOW, max_in_flight=HEDGE_MAX_IN_FLIGHT):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self.max_in_flight = max_in_flight
+        self._latencies = deque(maxlen=window)
+        self._hedged = deque(maxlen=window)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def threshold(self):
+        """Seconds to wait before hedging, or None while there are too few samples."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        value = max(ordered[min(int(len(ordered) * self.percentile), len(ordered) - 1)], self.min_delay)
+        metrics.set_gauge("hedge_threshold_seconds", round(value, 3))
+        return value
+
+    def record_request(self):
+        """Registers a request; returns its slot for try_hedge."""
+        slot = [False]
+        with self._lock:
+            self._hedged.append(slot)
+        return slot
+
+    def try_hedge(self, slot):
+        """Claims a hedge for the request in `slot` if the recent hedge rate is under the cap."""
+        with self._lock:
+            # 每个请求有自己的标记，并发的慢请求不会共用同一个计数位置
+            hedges = sum(1 for s in self._hedged if s[0])
+            allowed = not slot[0] and hedges + 1 <= self.max_rate * max(len(self._hedged), 1)
+            if allowed:
+                slot[0] = True
+                hedges += 1
+            rate = hedges / max(len(self._hedged), 1)
+        metrics.set_gauge("hedge_rate", round(rate, 4))
+        return allowed
+
+    def acquire_extra(self):
+        """Claims capacity for one extra request; False when max_in_flight are already running."""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return False
+            self._in_flight += 1
+            in_flight = self._in_flight
+        metrics.set_gauge("hedge_in_flight", in_flight)
+        return True
+
+    def release_extra(self):
+        with self._lock:
+            self._in_flight -= 1
+            in_flight = self._in_flight
+        metrics.set_gauge("hedge_in_flight", in_flight)
+
+
+_policy = HedgePolicy()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            from scheduler import SCHEDULER_CONCURRENCY
+            # 每个调度槽位一个请求，另加至多 HEDGE_MAX_IN_FLIGHT 个额外请求，原请求不会在池里排队
+            _executor = ThreadPoolExecutor(max_workers=SCHEDULER_CONCURRENCY + HEDGE_MAX_IN_FLIGHT,
+                                           thread_name_prefix="hedge")
+        return _executor
+
+
+def _is_valid(response):
+    try:
+        return bool(response.choices[0].message.content.strip())
+    except (AttributeError, IndexError, TypeError):
+        return False
+
+
+class _HedgedCompletions:
+    def __init__(self, primary, secondary, usage, policy):
+        self._primary = primary
+        self._secondary = secondary
+        self._usage = usage
+        self._policy = policy
+
+    def _call(self, client, kwargs, is_primary, started_event=None):
+        if started_event is not None:
+            started_event.set()
+        started = time.monotonic()
+        response = client.chat.completions.create(**kwargs)
+        if is_primary:
+            self._policy.observe(time.monotonic() - started)
+        return response
+
+    def _discard(self, future):
+        # 还没开始的直接取消；已发出的照样计费，完成后计入本任务用量，
+        # 任务已结算时由 JobUsage 直接补记到账本
+        if future.cancel():
+            return
+
+        def record(done):
+            if self._usage is not None and not done.cancelled() and done.exception() is None:
+                self._usage.record(getattr(done.result(), "usage", None))
+        future.add_done_callback(record)
+
+    def _release_when_done(self, *futures):
+        # 两个请求都结束（含被取消）后才归还额外请求的名额
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def finished(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._policy.release_extra()
+        for future in futures:
+            future.add_done_callback(finished)
+
+    def create(self, **kwargs):
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        executor = _get_executor()
+        kwargs.setdefault("timeout", HEDGE_REQUEST_TIMEOUT)
+        slot = self._policy.record_request()
+        started = threading.Event()
+        primary = executor.submit(self._call, self._primary, kwargs, True, started)
+        threshold = self._policy.threshold()
+        if threshold is None:
+            return primary.result()
+        # 从原请求真正发出时开始计时
+        started.wait()
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+        if not self._policy.try_hedge(slot):
+            metrics.inc("hedge_requests_total", outcome="rate_limited")
+            return primary.result()
+        if not self._policy.acquire_extra():
+            metrics.inc("hedge_requests_total", outcome="no_capacity")
+            return primary.result()
+
+        metrics.inc("hedge_requests_total", outcome="sent")
+        hedge_kwargs = dict(kwargs, model=HEDGE_MODEL) if HEDGE_MODEL and self._secondary is not self._primary else kwargs
+        hedge = executor.submit(self._call, self._secondary, hedge_kwargs, False)
+        self._release_when_done(primary, hedge)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                response = future.result()
+                if not _is_valid(response):
+                    continue
+                metrics.inc("hedge_requests_total", outcome="hedge_won" if future is hedge else "primary_won")
+                for loser in pending:
+                    self._discard(loser)
+                return response
+        # 两个请求都失败：按原请求的结果处理
+        if primary.exception() is None:
+            return primary.result()
+        raise error
+
+
+class HedgedClient:
+    """
+    Wraps an OpenAI client for translation batches: `chat.completions.create`
+    sends the request, and if it has not returned after the adaptive
+    threshold (HEDGE_PERCENTILE of recent primary latencies, at least
+    HEDGE_MIN_DELAY) sends a duplicate to `secondary`. The first valid
+    response wins. Hedges are capped at HEDGE_MAX_RATE of recent requests
+    and at HEDGE_MAX_IN_FLIGHT extra requests (hedges plus losers that
+    have not returned yet) on top of the scheduler's slots. Each request
+    has a HEDGE_REQUEST_TIMEOUT unless the caller sets one. A losing
+    response's usage is still recorded in `usage`, and reaches the usage
+    ledger even if the job was recorded there before it returned.
+    """
+
+    def __init__(self, primary, secondary=None, usage=None, policy=None):
+        self.chat = types.SimpleNamespace(
+            completions=_HedgedCompletions(primary, secondary or primary, usage, policy or _policy)
+        )
+
+
+def hedged(client, api_key, usage=None):
+    """`client` wrapped in a HedgedClient, with the configured secondary endpoint if any."""
+    from cassette import active_cassette
+    secondary = None
+    if HEDGE_BASE_URL:
+        cassette = active_cassette()
+        if cassette is not None:
+            secondary = cassette.openai_client(HEDGE_API_KEY or api_key, HEDGE_BASE_URL)
+        else:
+            from openai import OpenAI
+            secondary = OpenAI(api_key=HEDGE_API_KEY or api_key, base_url=HEDGE_BASE_URL)
+    return HedgedClient(client, secondary, usage)
@@ -0,0 +1,50 @@
+import threading
+
+# 进程内指标，/metrics 以 Prometheus 文本格式输出（多 worker 时每个进程各自统计）
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_help = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def get(name, **labels):
+    key = _key(name, labels)
+    with _lock:
+        return _counters.get(key, _gauges.get(key, 0))
+
+
+def render():
+    """Renders all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        series = [(key, value, "counter") for key, value in _counters.items()]
+        series += [(key, value, "gauge") for key, value in _gauges.items()]
+    seen = set()
+    for (name, labels), value, kind in sorted(series, key=lambda item: item[0]):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+        label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,77 @@
+import os
+import time
+import queue
+import threading
+
+import metrics
+
+# 每个阶段输入队列的容量；队列满时上游阻塞（背压），内存占用有上界
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 256))
+
+metrics.describe("pipeline_items_total", "Items processed by a pipeline stage")
+metrics.describe("pipeline_blocked_seconds_total", "Time producers spent waiting on a full stage queue")
+
+_CLOSE = object()
+
+
+class Stage:
+    """
+    One pipeline stage: a thread consuming items from a bounded queue, so it
+    runs concurrently with whatever produces them.
+
+    `put` blocks while the queue is full, which slows the producer down to
+    the stage's pace instead of buffering without limit. `fn(items)` gets up
+    to `batch_size` items at a time (whatever is queued). `start()`, if
+    given, runs first on the stage thread, e.g. to open a remote document
+    while the producer is still busy. After an error the stage drops the
+    remaining items; `close()` waits for the queue to drain and returns
+    the error, or None.
+    """
+
+    def __init__(self, name, fn, start=None, batch_size=1, maxsize=PIPELINE_QUEUE_SIZE):
+        self.name = name
+        self.fn = fn
+        self.start = start
+        self.batch_size = batch_size
+        self.error = None
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name=f"pipeline-{name}", daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            waited = time.monotonic()
+            self._queue.put(item)
+            metrics.inc("pipeline_blocked_seconds_total", time.monotonic() - waited, stage=self.name)
+
+    def close(self):
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        return self.error
+
+    def _run(self):
+        try:
+            if self.start is not None:
+                self.start()
+        except Exception as e:
+            self.error = e
+        while True:
+            items = [self._queue.get()]
+            while items[-1] is not _CLOSE and len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = items[-1] is _CLOSE
+            if closing:
+                items.pop()
+            if items and self.error is None:
+                try:
+                    self.fn(items)
+                    metrics.inc("pipeline_items_total", len(items), stage=self.name)
+                except Exception as e:
+                    self.error = e
+            if closing:
+                return
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+后台预取：定期检查订阅的频道/播放列表，把新视频的字幕提前下载到本地缓存，
+/api/translate 与 /api/extract 命中缓存时无需再调用 yt-dlp。
+可选在低峰时段用 bulk 优先级预先翻译。
+
+    python prefetch.py                      # 按 PREFETCH_INTERVAL 循环运行
+    python prefetch.py --once --pretranslate
+
+与 Web 服务使用相同的 TEMP_DIR，单独作为一个进程运行（每台机器一个）。
+"""
+
+import os
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+# 逗号分隔的频道或播放列表 URL，例如 https://www.youtube.com/@name/videos
+PREFETCH_SOURCES = os.environ.get("PREFETCH_SOURCES", "")
+PREFETCH_INTERVAL = int(os.environ.get("PREFETCH_INTERVAL", 900))
+# 每个来源只检查最新的若干个视频
+PREFETCH_RECENT = int(os.environ.get("PREFETCH_RECENT", 5))
+# 缓存超过这段时间的字幕重新下载一次，以发现作者更新或 YouTube 修正的字幕
+PREFETCH_REFRESH_AGE = int(os.environ.get("PREFETCH_REFRESH_AGE", 6 * 3600))
+# 低峰时段（本地时间，小时，左闭右开，可跨零点），例如 "1-7" 或 "22-6"
+PREFETCH_OFFPEAK_HOURS = os.environ.get("PREFETCH_OFFPEAK_HOURS", "1-7")
+# 预翻译使用的 DeepSeek 密钥，同样受每日预算限制
+PREFETCH_DEEPSEEK_KEY = os.environ.get("PREFETCH_DEEPSEEK_KEY", "")
+
+
+def list_recent_videos(source, limit=PREFETCH_RECENT):
+    """Returns [(video_id, url)] for the newest `limit` entries of a channel or playlist."""
+    from cassette import active_cassette
+    cassette = active_cassette()
+    if cassette is not None:
+        return cassette.list_videos(source, limit, _list_with_ytdlp)
+    return _list_with_ytdlp(source, limit)
+
+
+def _list_with_ytdlp(source, limit):
+    import yt_dlp
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'playlistend': limit,
+        'skip_download': True,
+        'quiet': True,
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(source, download=False)
+    except Exception as e:
+        print(f"读取来源失败 {source}: {e}")
+        return []
+    videos = []
+    for entry in (info or {}).get('entries') or []:
+        video_id = entry.get('id') if entry else None
+        if video_id:
+            videos.append((video_id, f"https://www.youtube.com/watch?v={video_id}"))
+    return videos[:limit]
+
+
+def is_offpeak(hours=PREFETCH_OFFPEAK_HOURS, now=None):
+    try:
+        start, end = (int(h) for h in hours.split("-", 1))
+    except ValueError:
+        return False
+    hour = (now or datetime.now()).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def prefetch_once(sources, recent=PREFETCH_RECENT, pretranslate_key=None):
+    """
+    One pass over `sources`. Returns (prefetched, pretranslated) counts.
+    Tracks cached more than PREFETCH_REFRESH_AGE ago are downloaded again;
+    a changed track invalidates its cached translation, and pre-translation
+    then only translates the changed lines. Pre-translation only runs in
+    off-peak hours.
+    """
+    from downloader import fetch_subtitle_track
+    from services import ServiceError, track_cache, produce_translation
+
+    prefetched = pretranslated = 0
+    for source in sources:
+        for video_id, url in list_recent_videos(source, recent):
+            cached = track_cache.get(video_id)
+            if cached is None or time.time() - cached['fetched'] > PREFETCH_REFRESH_AGE:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    track = fetch_subtitle_track(url, tmp_dir)
+                    if not track:
+                        continue
+                    track_cache.put(track)
+                prefetched += 1
+
+            if pretranslate_key and is_offpeak():
+                try:
+                    # 已有缓存译文时 produce_translation 直接复用，不会重复花费
+                    result = produce_translation(url, pretranslate_key, priority='bulk')
+                    if result['usage']['requests']:
+                        pretranslated += 1
+                except ServiceError as e:
+                    print(f"预翻译失败 {video_id}: {e}")
+                    if e.status == 402:
+                        # 预算用完，本轮不再预翻译
+                        pretranslate_key = None
+    return prefetched, pretranslated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefetch subtitle tracks of subscribed channels")
+    parser.add_argument("--sources", default=PREFETCH_SOURCES,
+                        help="comma-separated channel/playlist URLs (default: $PREFETCH_SOURCES)")
+    parser.add_argument("--recent", type=int, default=PREFETCH_RECENT)
+    parser.add_argument("--interval", type=int, default=PREFETCH_INTERVAL)
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--pretranslate", action="store_true",
+                        help="also translate new videos during off-peak hours ($PREFETCH_DEEPSEEK_KEY)")
+    args = parser.parse_args()
+
+    sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+    if not sources:
+        parser.error("no sources configured")
+    pretranslate_key = PREFETCH_DEEPSEEK_KEY if args.pretranslate else None
+    if args.pretranslate and not pretranslate_key:
+        parser.error("--pretranslate requires PREFETCH_DEEPSEEK_KEY")
+
+    while True:
+        started = time.time()
+        prefetched, pretranslated = prefetch_once(sources, args.recent, pretranslate_key)
+        print(f"预取完成：新缓存 {prefetched} 个字幕，预翻译 {pretranslated} 个，用时 {time.time() - started:.1f}s")
+        if args.once:
+            break
+        time.sleep(max(args.interval - (time.time() - started), 0))
+
+
+if __name__ == "__main__":
+    main()
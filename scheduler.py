@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+import metrics
+
+# 本进程发往 DeepSeek 的并发请求上限（所有任务共享）
+SCHEDULER_CONCURRENCY = int(os.environ.get("SCHEDULER_CONCURRENCY", 8))
+# 优先级类别及其权重：interactive 每轮可获得的请求槽位是 bulk 的 4 倍
+PRIORITY_WEIGHTS = OrderedDict([
+    ("interactive", int(os.environ.get("SCHEDULER_WEIGHT_INTERACTIVE", 4))),
+    ("bulk", int(os.environ.get("SCHEDULER_WEIGHT_BULK", 1))),
+])
+
+metrics.describe("scheduler_queued_batches", "Translation batches waiting for a slot, by priority class")
+metrics.describe("scheduler_running_batches", "Translation batches currently calling the API")
+
+
+class _JobQueue:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.tasks = deque()
+
+
+class BatchScheduler:
+    """
+    Runs translation batches on a fixed number of worker threads.
+
+    Slots are shared between priority classes by smooth weighted
+    round-robin, and between jobs of the same class by plain round-robin,
+    one batch per turn. A 4-hour livestream and a 3-minute clip in the same
+    class therefore alternate, and the clip finishes after a few turns
+    instead of queuing behind the whole livestream.
+    """
+
+    def __init__(self, concurrency=SCHEDULER_CONCURRENCY, weights=PRIORITY_WEIGHTS):
+        self.weights = OrderedDict(weights)
+        self._cond = threading.Condition()
+        # 每个类别：job_id -> _JobQueue，按轮转顺序排列
+        self._classes = {name: OrderedDict() for name in self.weights}
+        self._current = {name: 0 for name in self.weights}
+        self._running = 0
+        self._threads = []
+        for i in range(max(1, concurrency)):
+            thread = threading.Thread(target=self._worker, name=f"batch-scheduler-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job_id, priority, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs) for `job_id` and returns a Future."""
+        if priority not in self._classes:
+            raise ValueError(f"Unknown priority class: {priority}")
+        future = Future()
+        with self._cond:
+            queue = self._classes[priority].get(job_id)
+            if queue is None:
+                queue = self._classes[priority][job_id] = _JobQueue(job_id)
+            queue.tasks.append((future, fn, args, kwargs))
+            self._update_gauges()
+            self._cond.notify()
+        return future
+
+    def _pick_class(self):
+        # smooth weighted round-robin，只在有待处理任务的类别之间分配
+        ready = [name for name, jobs in self._classes.items() if jobs]
+        if not ready:
+            return None
+        total = 0
+        best = None
+        for name in ready:
+            self._current[name] += self.weights[name]
+            total += self.weights[name]
+            if best is None or self._current[name] > self._current[best]:
+                best = name
+        self._current[best] -= total
+        return best
+
+    def _next_task(self):
+        priority = self._pick_class()
+        if priority is None:
+            return None
+        jobs = self._classes[priority]
+        job_id, queue = jobs.popitem(last=False)
+        task = queue.tasks.popleft()
+        if queue.tasks:
+            # 该任务还有剩余批次，排到同类别队尾
+            jobs[job_id] = queue
+        return task
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                task = self._next_task()
+                while task is None:
+                    self._cond.wait()
+                    task = self._next_task()
+                self._running += 1
+                self._update_gauges()
+
+            future, fn, args, kwargs = task
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._update_gauges()
+
+    def _update_gauges(self):
+        for name, jobs in self._classes.items():
+            metrics.set_gauge("scheduler_queued_batches", sum(len(q.tasks) for q in jobs.values()), priority=name)
+        metrics.set_gauge("scheduler_running_batches", self._running)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide scheduler, created on first use (after any gunicorn fork)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BatchScheduler()
+        return _scheduler
@@ -0,0 +1,185 @@
+import os
+import re
+import time
+import sqlite3
+from contextlib import closing
+
+# 单次搜索最多返回的条数
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", 100))
+# 未提交的索引数据（进程崩溃等留下的）超过这段时间后清除
+SEARCH_STAGING_MAX_AGE = int(os.environ.get("SEARCH_STAGING_MAX_AGE", 24 * 3600))
+
+# 中日韩文字没有空格分词，切成重叠的二字组再交给 unicode61 分词器
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+
+
+def tokenize(text):
+    """Splits CJK runs into overlapping bigrams ('中国人' -> '中国 国人'); other text is left as is."""
+    def bigrams(match):
+        run = match.group(0)
+        if len(run) == 1:
+            return f" {run} "
+        return " " + " ".join(run[i:i + 2] for i in range(len(run) - 1)) + " "
+    return _CJK_RE.sub(bigrams, text)
+
+
+def build_query(text):
+    """
+    FTS5 query for free text: every whitespace-separated term must match,
+    as a phrase of its tokens. User input is always quoted, so FTS5 syntax
+    in it is matched literally. Returns None if nothing is searchable.
+    """
+    phrases = []
+    for term in text.split():
+        tokens = tokenize(term).split()
+        if not tokens:
+            continue
+        phrase = '"' + " ".join(tokens).replace('"', '""') + '"'
+        # 单个汉字只出现在二字组里，用前缀匹配
+        if len(tokens) == 1 and len(tokens[0]) == 1 and _CJK_RE.match(tokens[0]):
+            phrase += "*"
+        phrases.append(phrase)
+    return " AND ".join(phrases) or None
+
+
+class SearchIndex:
+    """
+    Full-text index over translated transcripts in one SQLite file shared
+    by all workers. Each written line is stored once in `lines` (video,
+    cue start in ms, original, translation); `lines_fts` is a contentless
+    FTS5 index over the bigram-tokenized text of both columns, ranked by
+    bm25.
+
+    Re-indexing a video writes a new generation of rows next to the live
+    one: `begin_video` returns the generation, `add_lines` stages rows in
+    it, and `commit_video` swaps it in and drops the old rows in one
+    transaction (`abort_video` drops the staged rows instead). Searches
+    only see the committed generation of each video.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS videos ("
+                " video_id TEXT PRIMARY KEY, title TEXT, url TEXT, indexed REAL,"
+                " generation INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS lines ("
+                " id INTEGER PRIMARY KEY, video_id TEXT NOT NULL, start_ms INTEGER NOT NULL,"
+                " original TEXT NOT NULL, translation TEXT NOT NULL, generation INTEGER NOT NULL DEFAULT 0)"
+            )
+            # 早期版本的数据库没有 generation 列，已有数据视为第 0 代
+            for table in ("videos", "lines"):
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+                if "generation" not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS lines_video ON lines (video_id)")
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5("
+                " original, translation, content='', tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _delete_rows(conn, where, params):
+        # 无内容 FTS 表删除时需要提供原来的分词文本
+        for row_id, original, translation in conn.execute(
+                f"SELECT id, original, translation FROM lines WHERE {where}", params).fetchall():
+            conn.execute(
+                "INSERT INTO lines_fts (lines_fts, rowid, original, translation) VALUES ('delete', ?, ?, ?)",
+                (row_id, tokenize(original), tokenize(translation))
+            )
+        conn.execute(f"DELETE FROM lines WHERE {where}", params)
+
+    def _transaction(self, fn):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                fn(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def begin_video(self, video_id):
+        """
+        Starts re-indexing `video_id`. Returns the new generation to pass to
+        add_lines and commit_video/abort_video; the live rows stay searchable.
+        """
+        # 以微秒时间戳作代号：同一视频的多次运行互不干扰，也能据此清除过期的未提交数据
+        generation = time.time_ns() // 1000
+
+        def clear_stale(conn):
+            committed = conn.execute("SELECT generation FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+            self._delete_rows(conn, "video_id = ? AND generation != ? AND generation < ?",
+                              (video_id, committed[0] if committed else -1,
+                               generation - SEARCH_STAGING_MAX_AGE * 1_000_000))
+        self._transaction(clear_stale)
+        return generation
+
+    def commit_video(self, video_id, generation, title, url):
+        """Makes `generation` the searchable version of `video_id` and drops the previous one."""
+        def swap(conn):
+            committed = conn.execute("SELECT generation FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+            if committed:
+                self._delete_rows(conn, "video_id = ? AND generation = ?", (video_id, committed[0]))
+            conn.execute(
+                "INSERT OR REPLACE INTO videos (video_id, title, url, indexed, generation) VALUES (?, ?, ?, ?, ?)",
+                (video_id, title, url, time.time(), generation)
+            )
+        self._transaction(swap)
+
+    def abort_video(self, video_id, generation):
+        """Drops the rows staged in `generation`."""
+        self._transaction(lambda conn: self._delete_rows(
+            conn, "video_id = ? AND generation = ?", (video_id, generation)))
+
+    def add_lines(self, video_id, rows, generation=0):
+        """Stages [(start_ms, original, translation), ...] in `generation`, in one transaction."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for start_ms, original, translation in rows:
+                    cursor = conn.execute(
+                        "INSERT INTO lines (video_id, start_ms, original, translation, generation)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (video_id, start_ms, original, translation, generation)
+                    )
+                    conn.execute(
+                        "INSERT INTO lines_fts (rowid, original, translation) VALUES (?, ?, ?)",
+                        (cursor.lastrowid, tokenize(original), tokenize(translation))
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def search(self, text, limit=20):
+        """Best-ranked lines matching `text`, with their video and cue start in ms."""
+        query = build_query(text)
+        if query is None:
+            return []
+        limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT l.video_id, v.title, v.url, l.start_ms, l.original, l.translation, bm25(lines_fts)"
+                " FROM lines_fts JOIN lines l ON l.id = lines_fts.rowid"
+                " JOIN videos v ON v.video_id = l.video_id AND v.generation = l.generation"
+                " WHERE lines_fts MATCH ? ORDER BY bm25(lines_fts) LIMIT ?",
+                (query, limit)
+            ).fetchall()
+        return [{
+            'video_id': video_id,
+            'title': title,
+            'url': url,
+            'start_ms': start_ms,
+            'link': f"https://www.youtube.com/watch?v={video_id}&t={start_ms // 1000}s",
+            'original': original,
+            'translation': translation,
+            'score': round(-score, 4),
+        } for video_id, title, url, start_ms, original, translation, score in rows]
@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+"""
+与 Web 框架无关的业务逻辑，Flask (WSGI) 与 ASGI 两种入口共用
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import metrics
+from downloader import fetch_subtitle_track
+from translator import MODEL, SYSTEM_PROMPT, write_translation
+from cue_store import iter_vtt_cues
+from feishu_uploader import FeishuDocAppender, get_tenant_access_token, upload_file_to_wiki
+from pipeline import Stage
+from workspace import WorkspaceManager
+from transcript_store import TranscriptStore, ConversationStore
+from scheduler import PRIORITY_WEIGHTS
+from usage import JobUsage, UsageLedger, BudgetExceeded, key_fingerprint
+from singleflight import SingleFlight, SingleFlightError, job_key, video_id_from_url
+from glossary import GlossaryStore
+from track_cache import TrackCache
+from translation_memory import TranslationMemory
+from search_index import SearchIndex
+from chat import (
+    CHAT_MODEL, CHAT_MODES, build_messages, build_reduce_messages, build_user_message,
+    choose_mode, compact_history, iter_map_results, aiter_map_results, turns_from_history
+)
+
+# Vercel兼容的配置
+TEMP_DIR = os.environ.get("TEMP_DIR") or ("/tmp" if os.environ.get("VERCEL") else ".")
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+
+# 每个请求使用独立的工作目录，按总大小/存活时间自动清理
+workspaces = WorkspaceManager(os.path.join(TEMP_DIR, "workspaces"))
+
+# 服务端保存字幕和对话历史，聊天请求只需携带 ID
+transcripts = TranscriptStore(os.path.join(TEMP_DIR, "transcripts"))
+conversations = ConversationStore(os.path.join(TEMP_DIR, "conversations"))
+
+# 同一视频的并发翻译请求合并为一次执行（跨 gunicorn worker 通过 SQLite 租约协调）
+translation_flights = SingleFlight(os.path.join(TEMP_DIR, "singleflight.db"))
+
+# 按 API 密钥（哈希）累计每日 token 用量与花费
+usage_ledger = UsageLedger(os.path.join(TEMP_DIR, "usage.db"))
+
+# 按频道维护的术语表（GLOSSARY_DIR/<channel_id>.json）
+glossaries = GlossaryStore()
+
+# 公开视频的字幕轨道与译文缓存，prefetch.py 会为订阅的频道提前填充
+track_cache = TrackCache(os.path.join(TEMP_DIR, "track_cache"))
+
+# 所有译文的全文索引（原文 + 译文 + 时间戳），/api/search 使用
+search_index = SearchIndex(os.path.join(TEMP_DIR, "search.db"))
+
+metrics.describe("track_cache_requests_total", "Subtitle track lookups in the warm cache, by result")
+metrics.describe("translation_cache_hits_total", "Translations served from the warm cache")
+
+
+class ServiceError(Exception):
+    """带 HTTP 状态码的业务错误，由各入口转换成 JSON 响应"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+def write_cookie_file(cookie_text, cookie_file):
+    """把浏览器复制的 cookie 字符串写成 Netscape 格式的 cookie 文件"""
+    with open(cookie_file, 'w') as f:
+        f.write("# Netscape HTTP Cookie File\n")
+        f.write("# Generated by YouTube Subtitle Translator\n\n")
+        cookies = cookie_text.strip().split(';')
+        for cookie in cookies:
+            cookie = cookie.strip()
+            if '=' in cookie:
+                name, value = cookie.split('=', 1)
+                f.write(f".youtube.com\tTRUE\t/\tFALSE\t0\t{name.strip()}\t{value.strip()}\n")
+    return cookie_file
+
+
+def fetch_track(video_url, ws, cookie_file=None, refresh=False):
+    """
+    Subtitle track for `video_url` in workspace `ws`: copied from the warm
+    cache when possible, otherwise downloaded with yt-dlp. `refresh` always
+    downloads (the captions may have been updated). Tracks fetched with the
+    user's cookies are never cached (they may be members-only).
+    """
+    video_id = video_id_from_url(video_url)
+    track = None if refresh else track_cache.copy_to(video_id, ws.path)
+    if track:
+        metrics.inc("track_cache_requests_total", result="hit")
+        print(f"字幕缓存命中: {video_id}")
+        return track
+    metrics.inc("track_cache_requests_total", result="refresh" if refresh else "miss")
+
+    track = fetch_subtitle_track(video_url, ws.path, cookie_file)
+    if track and not cookie_file:
+        track_cache.put(track)
+    return track
+
+
+def translation_cache_key(glossary):
+    """Identifies everything besides the track that changes the translation."""
+    options = [MODEL, SYSTEM_PROMPT, glossary.entries if glossary else []]
+    return hashlib.sha256(json.dumps(options, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+
+
+def translate_job(data):
+    """下载 → 翻译 → 保存 → (可选) 上传飞书，返回 API 响应字典"""
+    if not data or not data.get('video_url') or not data.get('deepseek_key'):
+        raise ServiceError('缺少必要参数', 400)
+
+    video_url = data['video_url']
+    deepseek_key = data['deepseek_key']
+    cookie_text = data.get('cookie_text', '')
+    enable_feishu = data.get('enable_feishu', False)
+    priority = data.get('priority', 'interactive')
+    if priority not in PRIORITY_WEIGHTS:
+        raise ServiceError('不支持的优先级', 400)
+    max_cost = data.get('max_cost')
+    if max_cost is not None and (not isinstance(max_cost, (int, float)) or max_cost <= 0):
+        raise ServiceError('max_cost 必须是正数', 400)
+    # 重新下载字幕，只翻译相对上次有变化的行
+    refresh = bool(data.get('refresh', False))
+    feishu = None
+    if enable_feishu:
+        feishu = {
+            'app_id': data.get('feishu_app_id'),
+            'app_secret': data.get('feishu_app_secret'),
+            'space_id': data.get('feishu_space_id'),
+        }
+        if not all(feishu.values()):
+            feishu = None
+
+    def produce():
+        return produce_translation(video_url, deepseek_key, cookie_text, max_cost, priority, refresh, feishu)
+
+    if cookie_text:
+        # 带 cookie 的结果可能是会员内容，不与其他请求共享
+        result, shared = produce(), False
+    else:
+        # 相同视频 + 相同输出选项 + 同一 API 密钥（用量和预算记在该密钥上）的并发请求
+        # 共享同一次下载和翻译；有失败或被截断的行的结果不留给后来的请求
+        key = job_key(video_url, {'base_url': DEEPSEEK_BASE_URL, 'refresh': refresh,
+                                  'key': key_fingerprint(deepseek_key), 'max_cost': max_cost})
+        try:
+            result, shared = translation_flights.do(
+                key, produce,
+                is_valid=lambda r: os.path.exists(r['output_path']),
+                cacheable=lambda r: not r['failed_lines']
+            )
+        except SingleFlightError as e:
+            raise ServiceError(str(e), e.status)
+    if shared:
+        print(f"复用进行中/刚完成的翻译任务: {video_url}")
+
+    # 步骤4: 上传到飞书（可选，每个请求使用自己的飞书配置）
+    feishu_node = None
+    feishu_partial = False
+    if feishu:
+        if not shared and result.get('feishu_node'):
+            feishu_node, feishu_partial = result['feishu_node'], result['feishu_partial']
+            if feishu_partial:
+                print(f"飞书文档不完整，节点: {feishu_node}")
+            else:
+                print(f"已边翻译边写入飞书文档，节点: {feishu_node}")
+        else:
+            # 复用了其他请求的结果，或没能创建飞书文档：上传完整文件
+            print("正在上传到飞书...")
+            token = get_tenant_access_token(feishu['app_id'], feishu['app_secret'])
+            if token:
+                feishu_node = upload_file_to_wiki(feishu['space_id'], result['output_path'], result['video_title'], token)
+                if feishu_node:
+                    print(f"已上传到飞书，节点: {feishu_node}")
+
+    return {
+        'success': True,
+        'filename': result['filename'],
+        'download_url': result['download_url'],
+        'preview': result['preview'],
+        'usage': result['usage'],
+        'reused_lines': result['reused_lines'],
+        'failed_lines': result['failed_lines'],
+        'feishu_node': feishu_node,
+        'feishu_partial': feishu_partial,
+        'shared': shared
+    }
+
+
+def start_feishu_stage(feishu, title):
+    """
+    Pipeline stage that writes translated entries into a new Feishu docx
+    while translation is still running. The token request and document
+    creation also happen on the stage thread. Returns (appender, stage).
+    """
+    appender = FeishuDocAppender(feishu['space_id'], title, None)
+
+    def start():
+        appender.token = get_tenant_access_token(feishu['app_id'], feishu['app_secret'])
+        if not appender.token:
+            raise RuntimeError('获取飞书 access token 失败')
+        appender.create()
+
+    # 每次请求最多追加 MAX_BLOCKS 个块，一条字幕占两个块
+    return appender, Stage('feishu', appender.append, start=start, batch_size=FeishuDocAppender.MAX_BLOCKS // 2)
+
+
+def start_index_stage(video_id):
+    """
+    Pipeline stage that stages a video's lines in a new search index
+    generation as they are written. Returns (generation, stage); the caller
+    commits or aborts the generation once the run is over.
+    """
+    generation = search_index.begin_video(video_id)
+    return generation, Stage('search', lambda rows: search_index.add_lines(video_id, rows, generation), batch_size=500)
+
+
+def produce_translation(video_url, deepseek_key, cookie_text='', max_cost=None, priority='interactive',
+                        refresh=False, feishu=None):
+    """
+    Downloads and translates one video into its own workspace. Returns a
+    JSON-serialisable description of the published output so concurrent
+    callers can share it. Lines translated by an earlier run of the same
+    video are reused, so a refreshed track only pays for what changed.
+    'failed_lines' counts lines left untranslated (errors or budget).
+
+    With `feishu` ({'app_id', 'app_secret', 'space_id'}), entries are also
+    appended to a Feishu docx as they are written. The document is only
+    created once pre-flight has passed and the first entry is written;
+    'feishu_node' in the result is None if no document was created, and
+    'feishu_partial' is True if it is missing entries.
+    """
+    try:
+        budget = usage_ledger.budget_for(deepseek_key, max_cost)
+    except BudgetExceeded as e:
+        raise ServiceError(str(e), e.status)
+    usage = JobUsage(deepseek_key)
+
+    with workspaces.create() as ws:
+        # 处理cookie
+        cookie_file = None
+        if cookie_text:
+            cookie_file = write_cookie_file(cookie_text, ws.path_for('cookies_netscape.txt'))
+
+        # 步骤1: 下载字幕
+        print(f"正在下载字幕: {video_url}")
+        track = fetch_track(video_url, ws, cookie_file, refresh)
+
+        if not track:
+            raise ServiceError('字幕下载失败')
+        vtt_path, video_title = track['path'], track['title']
+        glossary = glossaries.for_channel(track['channel_id'])
+        if glossary:
+            print(f"使用频道术语表: {len(glossary)} 条")
+
+        # 步骤2+3: 翻译字幕，逐批写入文件
+        print("正在翻译字幕...")
+        output_filename = f"{video_title}_翻译版.md"
+        # 清理文件名
+        output_filename = "".join([c for c in output_filename if c.isalpha() or c.isdigit() or c in (' ', '-', '_', '.')]).rstrip()
+        output_path = ws.path_for('translation.md')
+        cache_key = translation_cache_key(glossary)
+        cached_path = None if cookie_file else track_cache.get_translation(track['id'], cache_key)
+        reused_lines = 0
+        failed_lines = 0
+        feishu_node = None
+        feishu_partial = False
+
+        if cached_path:
+            # 预翻译或之前完整翻译过的结果，直接复用
+            metrics.inc("translation_cache_hits_total")
+            print(f"译文缓存命中: {track['id']}")
+            shutil.copyfile(cached_path, output_path)
+        else:
+            memory = None if cookie_file else TranslationMemory(track_cache.get_memory(track['id'], cache_key))
+            # 飞书文档与搜索索引和翻译同时进行：翻译好的条目经有界队列交给各自的写入线程
+            appender = feishu_stage = None
+            generation, index_stage = (None, None) if cookie_file else start_index_stage(track['id'])
+
+            def sink(start_ms, orig, trans):
+                nonlocal appender, feishu_stage
+                if feishu and feishu_stage is None:
+                    # 预检通过、开始写出条目后才创建飞书文档，被预算拒绝时不会留下空文档
+                    appender, feishu_stage = start_feishu_stage(feishu, video_title)
+                    feishu_stage.put(f"来源: {video_url}")
+                if feishu_stage:
+                    feishu_stage.put((orig, trans))
+                if index_stage:
+                    index_stage.put((start_ms, orig, trans))
+
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(f"# {video_title} (翻译版)\n\n")
+                f.write(f"来源: {video_url}\n\n")
+                stats = None
+                try:
+                    stats = write_translation(vtt_path, f, deepseek_key, DEEPSEEK_BASE_URL,
+                                              usage=usage, budget=budget, priority=priority, glossary=glossary,
+                                              memory=memory, sink=sink)
+                except BudgetExceeded as e:
+                    raise ServiceError(str(e), e.status)
+                finally:
+                    # 预检时预留的花费换成实际用量
+                    usage_ledger.add(usage, budget.reserved_cost)
+                    if feishu_stage:
+                        incomplete = not stats or stats['failed']
+                        if incomplete:
+                            feishu_stage.put("⚠️ 部分字幕翻译失败、被预算截断或翻译中断，本文档不完整")
+                        error = feishu_stage.close()
+                        if error:
+                            print(f"写入飞书文档失败: {error}")
+                        # 文档已创建但不完整时如实报告，不再另建一个节点
+                        feishu_node = appender.node_token
+                        feishu_partial = bool(error or incomplete)
+                    if index_stage:
+                        error = index_stage.close()
+                        if error:
+                            print(f"更新搜索索引失败: {error}")
+                        # 只有完整的译文替换已有索引；失败或中断时保留上次的索引
+                        try:
+                            if not error and stats and not stats['failed']:
+                                search_index.commit_video(track['id'], generation, video_title, video_url)
+                            else:
+                                search_index.abort_video(track['id'], generation)
+                        except Exception as e:
+                            print(f"更新搜索索引失败: {e}")
+
+            if not stats:
+                raise ServiceError('字幕翻译失败')
+            reused_lines = stats['reused']
+            failed_lines = stats['failed']
+            if memory is not None:
+                track_cache.put_memory(track['id'], cache_key, memory.to_dict())
+            # 只缓存完整的译文（无失败、未被预算截断）
+            if not cookie_file and not stats['failed']:
+                track_cache.put_translation(track['id'], cache_key, output_path)
+
+        # 只读取前500字符作为预览
+        with open(output_path, 'r', encoding='utf-8') as f:
+            content = f.read(501)
+        preview = content[:500] + "..." if len(content) > 500 else content
+
+        file_id = ws.publish('translation.md', download_name=output_filename, mimetype='text/markdown')
+
+        return {
+            'video_title': video_title,
+            'filename': output_filename,
+            'output_path': output_path,
+            'download_url': f'/download/{ws.job_id}/{file_id}',
+            'preview': preview,
+            'usage': usage.to_dict(),
+            'reused_lines': reused_lines,
+            'failed_lines': failed_lines,
+            'feishu_node': feishu_node,
+            'feishu_partial': feishu_partial
+        }
+
+
+def extract_job(data):
+    """提取字幕并保存到服务端，返回 API 响应字典"""
+    video_url = (data or {}).get('video_url')
+    cookie_text = (data or {}).get('cookie_text', '')
+    if not video_url:
+        raise ServiceError('缺少视频链接', 400)
+
+    with workspaces.create() as ws:
+        # 处理cookie
+        cookie_file = None
+        if cookie_text:
+            cookie_file = write_cookie_file(cookie_text, ws.path_for('cookies_netscape.txt'))
+
+        track = fetch_track(video_url, ws, cookie_file)
+        if not track:
+            raise ServiceError('字幕提取失败')
+        vtt_path, video_title = track['path'], track['title']
+
+        # 读取字幕内容
+        lines = []
+        for _, _, text in iter_vtt_cues(vtt_path):
+            text = text.replace('\n', ' ').strip()
+            if text:
+                lines.append(text)
+
+    transcript_id = transcripts.save(lines, video_title)
+
+    return {
+        'success': True,
+        'title': video_title,
+        'transcript_id': transcript_id,
+        'subtitles': lines
+    }
+
+
+def search_job(params):
+    """全文搜索已翻译的字幕，返回 API 响应字典"""
+    query = (params.get('q') or '').strip()
+    if not query:
+        raise ServiceError('缺少搜索词', 400)
+    try:
+        limit = int(params.get('limit', 20))
+    except (TypeError, ValueError):
+        raise ServiceError('limit 必须是整数', 400)
+    return {'success': True, 'query': query, 'hits': search_index.search(query, limit)}
+
+
+class ChatTurn:
+    """一次 /api/deepseek 请求解析、校验后的上下文"""
+
+    def __init__(self, api_key, transcript_id, transcript, conversation_id, conversation,
+                 instruction, selection, requested_mode):
+        self.api_key = api_key
+        self.transcript_id = transcript_id
+        self.transcript = transcript
+        self.conversation_id = conversation_id
+        self.conversation = conversation
+        self.instruction = instruction
+        self.user_message = build_user_message(instruction, selection)
+        self.mode = choose_mode(transcript['lines'], requested_mode, selection)
+
+    def start_event(self):
+        return {'conversation_id': self.conversation_id, 'transcript_id': self.transcript_id, 'mode': self.mode}
+
+    def save(self, answer):
+        if not answer:
+            return
+        conversations.put(self.conversation_id, dict(
+            self.conversation,
+            turns=self.conversation.get('turns', []) + [{'user': self.user_message, 'assistant': answer}]
+        ))
+
+
+def prepare_chat(data):
+    """
+    Validates a chat request and loads its transcript and conversation.
+    Blocking (file I/O, optional history compaction call).
+    """
+    data = data or {}
+    transcript_id = data.get('transcript_id', '')
+    conversation_id = data.get('conversation_id', '')
+    instruction = data.get('instruction', '')
+    selection = data.get('selection', '')
+    api_key = data.get('deepseek_key', '')
+    requested_mode = data.get('mode', 'auto')
+    if not instruction or not api_key:
+        raise ServiceError('缺少参数', 400)
+    if requested_mode not in CHAT_MODES:
+        raise ServiceError('不支持的模式', 400)
+
+    # 兼容旧客户端：直接上传整份字幕和历史
+    if not transcript_id and data.get('subtitles'):
+        transcript_id = transcripts.save(data['subtitles'])
+    transcript = transcripts.get(transcript_id)
+    if transcript is None:
+        raise ServiceError('字幕已过期，请重新提取', 404)
+
+    conversation = conversations.get(conversation_id) if conversation_id else None
+    if conversation is None or conversation.get('transcript_id') != transcript_id:
+        conversation_id = conversations.create(transcript_id)
+        conversation = conversations.get(conversation_id)
+        if data.get('history'):
+            conversation = dict(conversation, turns=turns_from_history(data['history']))
+
+    from openai import OpenAI
+    client = OpenAI(api_key=api_key, base_url=DEEPSEEK_BASE_URL)
+    conversation = compact_history(client, conversation)
+
+    return ChatTurn(api_key, transcript_id, transcript, conversation_id, conversation,
+                    instruction, selection, requested_mode)
+
+
+def chat_events(turn):
+    """同步生成 SSE 事件字典（WSGI 使用）"""
+    from openai import OpenAI
+    client = OpenAI(api_key=turn.api_key, base_url=DEEPSEEK_BASE_URL)
+
+    yield turn.start_event()
+    if turn.mode == 'map_reduce':
+        partials = []
+        for done, total, partials in iter_map_results(client, turn.transcript['lines'], turn.instruction):
+            yield {'status': f'分段处理中 {done}/{total}'}
+        messages = build_reduce_messages(partials, turn.conversation, turn.user_message)
+    else:
+        messages = build_messages(turn.transcript['lines'], turn.conversation, turn.user_message)
+
+    answer = []
+    try:
+        response = client.chat.completions.create(model=CHAT_MODEL, messages=messages, stream=True)
+        for chunk in response:
+            delta = chunk.choices[0].delta.content or ''
+            answer.append(delta)
+            yield {'delta': delta}
+    except Exception as e:
+        yield {'error': str(e)}
+    turn.save(''.join(answer))
+
+
+async def achat_events(turn):
+    """异步生成 SSE 事件字典（ASGI 使用），上游请求不占用线程"""
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key=turn.api_key, base_url=DEEPSEEK_BASE_URL)
+
+    yield turn.start_event()
+    if turn.mode == 'map_reduce':
+        partials = []
+        async for done, total, partials in aiter_map_results(client, turn.transcript['lines'], turn.instruction):
+            yield {'status': f'分段处理中 {done}/{total}'}
+        messages = build_reduce_messages(partials, turn.conversation, turn.user_message)
+    else:
+        messages = build_messages(turn.transcript['lines'], turn.conversation, turn.user_message)
+
+    answer = []
+    try:
+        response = await client.chat.completions.create(model=CHAT_MODEL, messages=messages, stream=True)
+        async for chunk in response:
+            delta = chunk.choices[0].delta.content or ''
+            answer.append(delta)
+            yield {'delta': delta}
+    except Exception as e:
+        yield {'error': str(e)}
+    turn.save(''.join(answer))
@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import secrets
+import threading
+from contextlib import closing
+from urllib.parse import urlparse, parse_qs
+
+SINGLEFLIGHT_LEASE_SECONDS = int(os.environ.get("SINGLEFLIGHT_LEASE_SECONDS", 120))
+# 已完成的结果在这段时间内可直接复用（突发流量下的重复提交）
+SINGLEFLIGHT_RESULT_TTL = int(os.environ.get("SINGLEFLIGHT_RESULT_TTL", 300))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.environ.get("SINGLEFLIGHT_POLL_INTERVAL", 0.5))
+
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+def video_id_from_url(url):
+    """
+    Extracts the YouTube video id from the common URL shapes without calling
+    yt-dlp. Returns None when the URL is not recognised.
+    """
+    try:
+        parsed = urlparse(url.strip())
+    except (AttributeError, ValueError):
+        return None
+    host = (parsed.hostname or "").lower()
+    candidate = None
+    if host.endswith("youtu.be"):
+        candidate = parsed.path.strip("/").split("/")[0]
+    elif host.endswith("youtube.com") or host.endswith("youtube-nocookie.com"):
+        if parsed.path == "/watch":
+            candidate = parse_qs(parsed.query).get("v", [None])[0]
+        else:
+            parts = parsed.path.strip("/").split("/")
+            if len(parts) >= 2 and parts[0] in ("shorts", "live", "embed", "v"):
+                candidate = parts[1]
+    if candidate and _VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+def job_key(video_url, options=None):
+    """Stable key for a job: the video id (or the raw URL) plus its output-affecting options."""
+    identity = video_id_from_url(video_url) or video_url.strip()
+    payload = json.dumps([identity, options or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlightError(Exception):
+    """The shared call failed; raised in every caller attached to it."""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers in the same process
+    wait on the leader's thread; callers in other workers on the box wait on
+    a lease row in a shared SQLite file and pick up the stored result.
+    Results must be JSON-serialisable.
+    """
+
+    def __init__(self, db_path, lease_seconds=SINGLEFLIGHT_LEASE_SECONDS,
+                 result_ttl=SINGLEFLIGHT_RESULT_TTL, poll_interval=SINGLEFLIGHT_POLL_INTERVAL):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flights ("
+                " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL,"
+                " finished REAL, result TEXT, error TEXT, status INTEGER)"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def do(self, key, fn, is_valid=None, cacheable=None):
+        """
+        Returns (result, shared). `shared` is True when the result came from
+        another caller's run. `is_valid(result)` can reject a stored result
+        (e.g. its output file was evicted) so the work is redone. A result
+        for which `cacheable(result)` is false (e.g. a partial one) still
+        goes to the callers already waiting, but is not reused afterwards.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._do_across_workers(key, fn, is_valid, cacheable)
+            return call.result, shared
+        except SingleFlightError as e:
+            call.error = e
+            raise
+        except Exception as e:
+            call.error = SingleFlightError(str(e), getattr(e, "status", 500))
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _do_across_workers(self, key, fn, is_valid, cacheable):
+        while True:
+            state, owner, payload = self._acquire(key, is_valid)
+            if state == "leader":
+                return self._lead(key, owner, fn, cacheable), False
+            if state == "result":
+                return payload, True
+            outcome = self._wait(key, owner)
+            if outcome is not None:
+                return outcome, True
+            # 领导者的租约过期（进程崩溃等），重新竞争
+
+    def _acquire(self, key, is_valid):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT owner, expires, finished, result, error FROM flights WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                owner, expires, finished, result, error = row
+                if finished is None and expires > now:
+                    conn.execute("COMMIT")
+                    return "follower", owner, None
+                if finished is not None and error is None and now - finished < self.result_ttl:
+                    value = json.loads(result)
+                    if is_valid is None or is_valid(value):
+                        conn.execute("COMMIT")
+                        return "result", owner, value
+            owner = secrets.token_hex(8)
+            conn.execute(
+                "INSERT OR REPLACE INTO flights (key, owner, expires, finished, result, error, status)"
+                " VALUES (?, ?, ?, NULL, NULL, NULL, NULL)",
+                (key, owner, now + self.lease_seconds)
+            )
+            conn.execute("COMMIT")
+            return "leader", owner, None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _lead(self, key, owner, fn, cacheable=None):
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(key, owner, stop), daemon=True)
+        renewer.start()
+        try:
+            result = fn()
+        except Exception as e:
+            self._finish(key, owner, error=str(e), status=getattr(e, "status", 500))
+            raise
+        finally:
+            stop.set()
+        finished = None
+        if cacheable is not None and not cacheable(result):
+            # 记为已过期：正在等待的调用方照样取走结果，之后的请求重新执行
+            finished = time.time() - self.result_ttl
+        self._finish(key, owner, result=json.dumps(result, ensure_ascii=False), finished=finished)
+        return result
+
+    def _renew(self, key, owner, stop):
+        # 领导者存活期间定期续租，进程退出后租约自然过期
+        while not stop.wait(self.lease_seconds / 3):
+            with closing(self._connect()) as conn:
+                conn.execute(
+                    "UPDATE flights SET expires = ? WHERE key = ? AND owner = ? AND finished IS NULL",
+                    (time.time() + self.lease_seconds, key, owner)
+                )
+
+    def _finish(self, key, owner, result=None, error=None, status=None, finished=None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE flights SET finished = ?, result = ?, error = ?, status = ? WHERE key = ? AND owner = ?",
+                (finished or time.time(), result, error, status, key, owner)
+            )
+
+    def _wait(self, key, owner):
+        """Polls until `owner`'s run finishes. Returns its result, or None if the lease was lost."""
+        while True:
+            time.sleep(self.poll_interval)
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT owner, expires, finished, result, error, status FROM flights WHERE key = ?", (key,)
+                ).fetchone()
+            finally:
+                conn.close()
+            if not row or row[0] != owner:
+                return None
+            _, expires, finished, result, error, status = row
+            if finished is not None:
+                if error is not None:
+                    raise SingleFlightError(error, status or 500)
+                return json.loads(result)
+            if expires < time.time():
+                return None
@@ -0,0 +1,41 @@
+import os
+import gzip
+import hashlib
+import mimetypes
+from functools import lru_cache
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+class Asset:
+    """
+    A static file loaded once per process, with its gzip body and ETag
+    computed up front so serving it costs no templating or compression.
+    """
+
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=9)
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.mimetype = f"{mimetype}; charset=utf-8" if mimetype.startswith("text/") else mimetype
+
+    def respond(self, accept_encoding=""):
+        """Returns (body, headers) for the given Accept-Encoding header."""
+        headers = {
+            "Content-Type": self.mimetype,
+            "ETag": f'"{self.etag}"',
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if "gzip" in accept_encoding:
+            headers["Content-Encoding"] = "gzip"
+            return self.gzip_body, headers
+        return self.body, headers
+
+
+@lru_cache(maxsize=None)
+def load_asset(name):
+    with open(os.path.join(STATIC_DIR, os.path.basename(name)), "rb") as f:
+        return Asset(name, f.read())
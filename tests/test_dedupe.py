@@ -0,0 +1,92 @@
+import io
+import contextlib
+
+import pytest
+
+from cue_store import CueStore
+from dedupe import DedupeIndex, build_units
+from translator import write_translation
+
+
+# (a, b, same unit?)
+PAIRS = [
+    ("We are now on page 45 of the report", "We are now on page 46 of the report", False),
+    ("The company raised 20 million dollars last year", "The company raised 30 million dollars last year", False),
+    ("The startup was founded in 2012 in Berlin", "The startup was founded in 2021 in Berlin", False),
+    ("You can buy the whole thing for 5000 dollars", "You can buy the whole thing for 50000 dollars", False),
+    ("we need to store the data on the disk", "we need to restore the data from disk", False),
+    ("Hello everyone and welcome back to the channel", "hello everyone, and welcome back to the channel!!", True),
+    ("so today we are going to talk about caching", "Um, so today we are going to talk about caching", True),
+    ("so today we are going to talk about caching strategies",
+     "so today were going to talk about caching strategies", True),
+    ("the results were published in 2021 by the team", "the results were published in 2021 by the team.", True),
+]
+
+
+@pytest.mark.parametrize("a, b, same", PAIRS)
+def test_near_duplicates(a, b, same):
+    index = DedupeIndex()
+    assert (index.add(a) == index.add(b)) is same
+
+
+def test_index_grows_past_its_initial_size():
+    index = DedupeIndex()
+    lines = [f"line number {n} of the long live stream" for n in range(3000)]
+    units = [index.add(line) for line in lines]
+    assert len(set(units)) == len(lines)
+    assert [index.add(line + "!") for line in lines] == units
+
+
+def _units(lines):
+    store = CueStore()
+    for n, line in enumerate(lines):
+        store.add(n * 1000, n * 1000 + 1000, line)
+    canonical, unit_of = build_units(store)
+    return [unit_of[text_id] for text_id in store.text_ids], [store.text(text_id) for text_id in canonical]
+
+
+def test_rolling_partial_merges_with_the_adjacent_cue():
+    units, canonical = _units(["we are going to", "we are going to lose", "now let us look at the numbers"])
+    assert units[0] == units[1] != units[2]
+    assert canonical[units[0]] == "we are going to lose"
+
+
+def test_prefix_elsewhere_in_the_video_keeps_its_own_unit():
+    units, _ = _units(["we are going to lose", "now let us look at the numbers", "we are going to"])
+    assert len(set(units)) == 3
+    # 同一短句既有滚动出现又单独出现时，也单独翻译
+    units, _ = _units(["we are going to", "we are going to lose", "now let us look at the numbers",
+                       "we are going to"])
+    assert units[0] != units[1]
+    assert units[0] == units[3]
+
+
+class _EchoCompletions:
+    def create(self, model, messages, stream=False, **kwargs):
+        from types import SimpleNamespace
+        content = "\n".join(f"T:{line}" for line in messages[-1]["content"].split("\n"))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+class _EchoClient:
+    def __init__(self):
+        from types import SimpleNamespace
+        self.chat = SimpleNamespace(completions=_EchoCompletions())
+
+
+def test_writer_keeps_each_cue_original(tmp_path):
+    vtt = tmp_path / "track.en.vtt"
+    vtt.write_text(
+        "WEBVTT\n\n"
+        "00:00:01.000 --> 00:00:02.000\nHello everyone, welcome back to the channel\n\n"
+        "00:00:02.000 --> 00:00:03.000\nnow let us look at the numbers\n\n"
+        "00:00:03.000 --> 00:00:04.000\nhello everyone welcome back to the channel!\n\n",
+        encoding="utf-8",
+    )
+    out = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = write_translation(str(vtt), out, "key", client=_EchoClient())
+    assert stats["unique"] == 2
+    body = out.getvalue()
+    assert "> Hello everyone, welcome back to the channel\n" in body
+    assert "> hello everyone welcome back to the channel!\n" in body
@@ -0,0 +1,20 @@
+import pytest
+
+from glossary import Glossary
+
+GLOSSARY = Glossary([
+    {"source": "Go", "target": "Go 语言", "variants": ["Golang"]},
+    {"source": "Claude", "target": "克劳德", "variants": ["克劳", "克罗德"]},
+])
+
+
+@pytest.mark.parametrize("source, translated, expected", [
+    ("We use Go at Google", "我们在 Google 用 Go", "我们在 Google 用 Go 语言"),
+    ("Go is fast", "Golang 很快", "Go 语言 很快"),
+    ("Claude is here", "克罗德在这里", "克劳德在这里"),
+    ("ask Claude", "问克劳。", "问克劳德。"),
+    ("Claude met Claudia", "克劳迪见到了克劳", "克劳迪见到了克劳德"),
+    ("Claude said so", "克劳德这么说", "克劳德这么说"),
+])
+def test_patch(source, translated, expected):
+    assert GLOSSARY.patch(source, translated) == expected
@@ -0,0 +1,77 @@
+import threading
+
+from hedging import HedgePolicy
+
+
+def test_hedge_rate_cap_holds_for_concurrent_stragglers():
+    policy = HedgePolicy(max_rate=0.1, window=200)
+    for _ in range(100):
+        policy.record_request()
+    stragglers = [policy.record_request() for _ in range(50)]
+
+    granted = []
+    barrier = threading.Barrier(len(stragglers))
+
+    def straggle(slot):
+        barrier.wait()
+        if policy.try_hedge(slot):
+            granted.append(slot)
+
+    threads = [threading.Thread(target=straggle, args=(slot,)) for slot in stragglers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(granted) == 15
+    assert sum(1 for slot in stragglers if slot[0]) == len(granted)
+
+
+def test_hedge_claimed_once_per_request():
+    policy = HedgePolicy(max_rate=1.0, window=10)
+    slot = policy.record_request()
+    assert policy.try_hedge(slot)
+    assert not policy.try_hedge(slot)
+
+
+def test_hedges_are_bounded_by_extra_capacity():
+    import time
+    from types import SimpleNamespace
+    from hedging import HedgedClient
+
+    release = threading.Event()
+
+    class SlowCompletions:
+        def __init__(self):
+            self.calls = 0
+            self.timeouts = []
+
+        def create(self, timeout=None, **kwargs):
+            self.calls += 1
+            self.timeouts.append(timeout)
+            release.wait(5)
+            message = SimpleNamespace(content="ok")
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    completions = SlowCompletions()
+    primary = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    policy = HedgePolicy(min_samples=1, min_delay=0.05, max_rate=1.0, window=10, max_in_flight=1)
+    policy.observe(0.01)
+    client = HedgedClient(primary, policy=policy)
+
+    threads = [threading.Thread(target=client.chat.completions.create, kwargs={"model": "m", "messages": []})
+               for _ in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.5)
+    # 三个慢请求只有一个能发出对冲请求
+    assert completions.calls == 4
+    release.set()
+    for t in threads:
+        t.join()
+    # 两个请求都结束后归还名额（完成回调可能稍晚于结果返回）
+    deadline = time.monotonic() + 2
+    while not policy.acquire_extra():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert set(completions.timeouts) == {120.0}
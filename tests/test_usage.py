@@ -0,0 +1,41 @@
+import pytest
+
+import usage
+from usage import BudgetExceeded, JobUsage, UsageLedger, estimate_job
+
+
+def _estimate(lines):
+    return estimate_job(["a caption line of a video"] * lines, 20, "system prompt")
+
+
+def test_concurrent_jobs_share_the_daily_key_budget(tmp_path, monkeypatch):
+    estimate = _estimate(100)
+    monkeypatch.setattr(usage, "KEY_DAILY_MAX_COST", estimate['cost'] * 1.5)
+    ledger = UsageLedger(str(tmp_path / "usage.db"))
+
+    # 两个任务同时开始，都在对方结算前做预检
+    first = ledger.budget_for("key")
+    second = ledger.budget_for("key")
+    assert first.preflight(estimate) == 100
+    assert first.reserved_cost == pytest.approx(estimate['cost'])
+    with pytest.raises(BudgetExceeded):
+        second.preflight(estimate)
+
+    # 结算后预留换成实际用量
+    job = JobUsage("key")
+    job.cost = estimate['cost'] / 2
+    ledger.add(job, first.reserved_cost)
+    third = ledger.budget_for("key")
+    assert third.preflight(estimate) == 100
+    assert ledger.spent_today(job.key_fp) == pytest.approx(estimate['cost'] / 2)
+
+
+def test_usage_recorded_after_settling_reaches_the_ledger(tmp_path):
+    from types import SimpleNamespace
+    ledger = UsageLedger(str(tmp_path / "usage.db"))
+    job = JobUsage("key")
+    job.record(SimpleNamespace(prompt_tokens=100, completion_tokens=50))
+    ledger.add(job)
+    # 落败的对冲请求在任务结算后才返回
+    job.record(SimpleNamespace(prompt_tokens=100, completion_tokens=50))
+    assert ledger.spent_today(job.key_fp) == pytest.approx(job.cost)
@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+TRACK_CACHE_MAX_AGE = int(os.environ.get("TRACK_CACHE_MAX_AGE", 7 * 24 * 3600))
+TRACK_CACHE_SWEEP_INTERVAL = int(os.environ.get("TRACK_CACHE_SWEEP_INTERVAL", 600))
+
+TRACK_MANIFEST = "track.json"
+TRACK_FILE = "subtitles.vtt"
+
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class TrackCache:
+    """
+    Subtitle tracks (and finished translations) of public videos, keyed by
+    video id, so requests for prefetched or recently seen videos skip
+    yt-dlp entirely. One directory per video:
+
+        <root>/<video_id>/track.json         id, title, channel_id, fetched, sha256
+        <root>/<video_id>/subtitles.vtt
+        <root>/<video_id>/translation-<key>.md
+        <root>/<video_id>/memory-<key>.json  unit translations of the last run
+
+    track.json is written last, so a directory without it is incomplete.
+    Entries expire `max_age` seconds after they were fetched. Storing a
+    changed track drops its finished translations but keeps the memory,
+    so the next run only translates what changed.
+    """
+
+    def __init__(self, root, max_age=TRACK_CACHE_MAX_AGE, sweep_interval=TRACK_CACHE_SWEEP_INTERVAL):
+        self.root = root
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, video_id):
+        if not video_id or not _VIDEO_ID_RE.match(video_id):
+            return None
+        return os.path.join(self.root, video_id)
+
+    def _read_manifest(self, video_dir):
+        try:
+            with open(os.path.join(video_dir, TRACK_MANIFEST), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, video_id):
+        """Returns the cached track {'path', 'id', 'title', 'channel_id'} or None."""
+        video_dir = self._dir(video_id)
+        if video_dir is None:
+            return None
+        manifest = self._read_manifest(video_dir)
+        if not manifest or time.time() - manifest.get("fetched", 0) > self.max_age:
+            return None
+        path = os.path.join(video_dir, TRACK_FILE)
+        if not os.path.exists(path):
+            return None
+        return dict(manifest, path=path)
+
+    def copy_to(self, video_id, dest_dir):
+        """Copies a cached track into `dest_dir` (a job workspace). Returns the track or None."""
+        track = self.get(video_id)
+        if track is None:
+            return None
+        dest = os.path.join(dest_dir, f"{video_id}.vtt")
+        try:
+            shutil.copyfile(track["path"], dest)
+        except OSError:
+            return None
+        return dict(track, path=dest)
+
+    def put(self, track):
+        """Stores a track returned by downloader.fetch_subtitle_track. Returns it with its sha256."""
+        self.maybe_sweep()
+        video_dir = self._dir(track.get("id"))
+        if video_dir is None:
+            return
+        os.makedirs(video_dir, exist_ok=True)
+        sha256 = _file_sha256(track["path"])
+        previous = self._read_manifest(video_dir)
+        if previous and previous.get("sha256") != sha256:
+            # 字幕已更新，旧的完整译文作废
+            for name in os.listdir(video_dir):
+                if name.startswith("translation-"):
+                    try:
+                        os.remove(os.path.join(video_dir, name))
+                    except OSError:
+                        pass
+        tmp_path = os.path.join(video_dir, f"{TRACK_FILE}.{os.getpid()}.tmp")
+        shutil.copyfile(track["path"], tmp_path)
+        os.replace(tmp_path, os.path.join(video_dir, TRACK_FILE))
+        manifest = {
+            "id": track["id"],
+            "title": track["title"],
+            "channel_id": track.get("channel_id"),
+            "fetched": time.time(),
+            "sha256": sha256,
+        }
+        self._write_json(os.path.join(video_dir, TRACK_MANIFEST), manifest)
+        return dict(manifest, path=track["path"])
+
+    def get_translation(self, video_id, key):
+        """Path of a finished translation made with options `key`, or None."""
+        video_dir = self._dir(video_id)
+        if video_dir is None or not _KEY_RE.match(key) or self.get(video_id) is None:
+            return None
+        path = os.path.join(video_dir, f"translation-{key}.md")
+        return path if os.path.exists(path) else None
+
+    def put_translation(self, video_id, key, source_path):
+        video_dir = self._dir(video_id)
+        if video_dir is None or not _KEY_RE.match(key) or self.get(video_id) is None:
+            return
+        path = os.path.join(video_dir, f"translation-{key}.md")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def get_memory(self, video_id, key):
+        """Unit translations saved by the last run with options `key` ({} if none)."""
+        video_dir = self._dir(video_id)
+        if video_dir is None or not _KEY_RE.match(key):
+            return {}
+        try:
+            with open(os.path.join(video_dir, f"memory-{key}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def put_memory(self, video_id, key, entries):
+        video_dir = self._dir(video_id)
+        if video_dir is None or not _KEY_RE.match(key) or not os.path.isdir(video_dir):
+            return
+        self._write_json(os.path.join(video_dir, f"memory-{key}.json"), entries)
+
+    @staticmethod
+    def _write_json(path, value):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def maybe_sweep(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        self.sweep(now)
+
+    def sweep(self, now=None):
+        """Removes expired and incomplete entries."""
+        now = now or time.time()
+        for video_id in os.listdir(self.root):
+            video_dir = os.path.join(self.root, video_id)
+            if not os.path.isdir(video_dir):
+                continue
+            manifest = self._read_manifest(video_dir)
+            if manifest is None:
+                # 可能正在写入；超过存活时间仍不完整才删除
+                try:
+                    if now - os.path.getmtime(video_dir) <= self.max_age:
+                        continue
+                except OSError:
+                    continue
+            elif now - manifest.get("fetched", 0) <= self.max_age:
+                continue
+            shutil.rmtree(video_dir, ignore_errors=True)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import time
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+
+TRANSCRIPT_MAX_AGE = int(os.environ.get("TRANSCRIPT_MAX_AGE", 24 * 3600))
+# 两次过期清理之间的最短间隔（秒）
+TRANSCRIPT_SWEEP_INTERVAL = int(os.environ.get("TRANSCRIPT_SWEEP_INTERVAL", 300))
+
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class JsonStore:
+    """
+    Small file-backed key/value store shared by all workers on the box, with
+    an in-process LRU in front of it. Entries older than `max_age` expire;
+    writes periodically sweep expired files so the directory stays bounded.
+    """
+
+    def __init__(self, root, max_age=TRANSCRIPT_MAX_AGE, cache_size=32, sweep_interval=TRANSCRIPT_SWEEP_INTERVAL):
+        self.root = root
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.sweep_interval = sweep_interval
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, key):
+        if not key or not _ID_RE.match(key):
+            return None
+        path = self._path(key)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - mtime > self.max_age:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == mtime:
+                self._cache.move_to_end(key)
+                return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, mtime, value)
+        return value
+
+    def put(self, key, value):
+        self.maybe_sweep()
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._remember(key, os.path.getmtime(path), value)
+        return key
+
+    def touch(self, key):
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            pass
+
+    def maybe_sweep(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        self.sweep(now)
+
+    def sweep(self, now=None):
+        """Removes entries (and leftover temp files) older than `max_age`."""
+        now = now or time.time()
+        removed = 0
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return 0
+        for name in names:
+            if not (name.endswith(".json") or name.endswith(".tmp")):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                if now - os.path.getmtime(path) <= self.max_age:
+                    continue
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # 其他进程可能刚刚删除或更新了它
+                continue
+        return removed
+
+    def _remember(self, key, mtime, value):
+        with self._lock:
+            self._cache[key] = (mtime, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+class TranscriptStore(JsonStore):
+    """Transcripts are keyed by content hash, so re-extracting a video reuses its id."""
+
+    def save(self, lines, title=None):
+        digest = hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()[:32]
+        if self.get(digest) is not None:
+            self.touch(digest)
+            return digest
+        return self.put(digest, {"title": title, "lines": lines})
+
+
+class ConversationStore(JsonStore):
+    """
+    Chat history for one transcript. `summary` holds the compacted older
+    turns, `turns` the recent ones exactly as they were sent to the model.
+    """
+
+    def create(self, transcript_id):
+        conversation_id = secrets.token_urlsafe(12)
+        self.put(conversation_id, {"transcript_id": transcript_id, "summary": "", "turns": []})
+        return conversation_id
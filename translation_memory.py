@@ -0,0 +1,36 @@
+from dedupe import normalize
+
+
+class TranslationMemory:
+    """
+    Unit translations from the previous run over the same video, keyed by
+    normalized source text. A re-run looks every unit up here first and
+    only sends inserted or changed units to the API.
+
+    `entries` holds the previous run; what the current run produces (reused
+    or new) is collected separately, so lines removed from the track drop
+    out of the memory that gets saved.
+    """
+
+    def __init__(self, entries=None):
+        self._previous = dict(entries or {})
+        self._current = {}
+        self.reused = 0
+
+    def __len__(self):
+        return len(self._previous)
+
+    def lookup(self, text):
+        """Previous translation of `text`, or None."""
+        key = normalize(text)
+        translation = self._previous.get(key)
+        if translation is not None:
+            self._current[key] = translation
+            self.reused += 1
+        return translation
+
+    def record(self, text, translation):
+        self._current[normalize(text)] = translation
+
+    def to_dict(self):
+        return dict(self._current)
@@ -1,113 +1,289 @@
+import io
 import os
-import webvtt
-from openai import OpenAI
+import uuid
+from array import array
+from collections import deque
+from cue_store import CueStore, TextTable
 
-def translate_subtitles(vtt_file_path, api_key, base_url="https://api.deepseek.com"):
+SYSTEM_PROMPT = "You are a professional translator. Translate the following subtitle lines into Simplified Chinese. Maintain the line-by-line structure. Output ONLY the translated lines, one per original line. Do not add any intro or outro."
+MODEL = "deepseek-chat"
+BATCH_SIZE = 20
+# 单个任务同时排队/执行的批次数上限，限制内存占用
+MAX_IN_FLIGHT_BATCHES = int(os.environ.get("MAX_IN_FLIGHT_BATCHES", 16))
+
+def _clean_text(text):
     """
-    Parses a VTT file, translates the content using DeepSeek API, 
-    and returns a formatted string (Original + Translation).
+    Cleans one caption text. Returns None for empty and timestamp-only
+    lines, which are dropped.
+    """
+    # 清理文本：移除换行符和多余空格
+    text = text.replace('\n', ' ').strip()
+
+    # 跳过空行或仅包含时间戳的行
+    if not text or text.strip() == '':
+        return None
+
+    # 跳过纯时间戳行（YouTube VTT经常有这种重复）
+    if text.replace('.', '').replace(':', '').replace(' ', '').isdigit():
+        return None
+
+    return text
+
+def _translate_batch(client, caption_batch, usage=None, glossary=None):
+    """
+    Translates one batch of lines. Returns a list of translations aligned
+    with `caption_batch`; raises on API errors. With a `glossary`, only the
+    terms found in this batch are sent, and the output is patched to them.
+    """
+    original_text_block = "\n".join(caption_batch)
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if glossary is not None:
+        # 术语放在固定系统提示词之后，不影响前缀缓存
+        glossary_prompt = glossary.prompt(glossary.match_batch(caption_batch))
+        if glossary_prompt:
+            messages.append({"role": "system", "content": glossary_prompt})
+    messages.append({"role": "user", "content": original_text_block})
+
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        stream=False
+    )
+    if usage is not None:
+        usage.record(getattr(response, "usage", None))
+
+    translated_response = response.choices[0].message.content.strip()
+    translated_block = translated_response.split('\n')
+
+    # 清理翻译结果：移除空行
+    translated_block = [line.strip() for line in translated_block if line.strip()]
+
+    # Align translations with originals
+    # 改进的匹配逻辑，处理行数不匹配的情况
+    if len(translated_block) != len(caption_batch):
+        print(f"⚠️  警告: 批次行数不匹配 (原文: {len(caption_batch)}, 翻译: {len(translated_block)})")
+
+        # 如果翻译行数较少，重复使用最后一行
+        if len(translated_block) < len(caption_batch):
+            while len(translated_block) < len(caption_batch):
+                translated_block.append(translated_block[-1] if translated_block else "[翻译缺失]")
+
+        # 如果翻译行数较多，截取前面的行
+        elif len(translated_block) > len(caption_batch):
+            translated_block = translated_block[:len(caption_batch)]
+
+    if glossary is not None:
+        translated_block = [glossary.patch(orig, trans) for orig, trans in zip(caption_batch, translated_block)]
+
+    return translated_block
+
+def _run_batch(client, caption_batch, usage, budget, glossary=None):
+    """Scheduler task: skips the batch (returns None) once the job is over budget."""
+    if usage is not None and usage.over_budget(budget):
+        return None
+    return _translate_batch(client, caption_batch, usage, glossary)
+
+def _iter_batches(units, unit_text):
+    """Yields (unit ids, texts) for `units`, BATCH_SIZE at a time."""
+    for i in range(0, len(units), BATCH_SIZE):
+        batch_units = units[i:i + BATCH_SIZE]
+        yield batch_units, [unit_text(unit) for unit in batch_units]
+
+def write_translation(vtt_file_path, out, api_key, base_url="https://api.deepseek.com", usage=None, budget=None,
+                      priority="interactive", client=None, glossary=None, memory=None, sink=None):
+    """
+    Parses a VTT file, translates it and streams the Markdown body
+    (Original + Translation) to the text file `out` batch by batch.
+    Returns {'captions': ..., 'unique': ..., 'reused': ..., 'failed': ...}
+    or None if the VTT can't be read; 'failed' counts units left
+    untranslated.
+
+    Cues are held in a compact CueStore and at most MAX_IN_FLIGHT_BATCHES
+    batches are materialised at a time, so memory does not grow with the
+    length of the video. Lines that differ only in case, punctuation,
+    fillers or a trailing word are grouped into one unit (see dedupe.py);
+    each unit is translated once and written at every place it occurs,
+    except for immediate repeats of the previous line. Units found in
+    `memory` (translation_memory.TranslationMemory) are reused without a
+    request, and new translations are recorded in it. `sink`, if given, is
+    called as sink(start_ms, original, translation) for every entry as it
+    is written, e.g. to upload or index while translating. See
+    translate_subtitles for `usage`, `budget`, `priority` and `glossary`;
+    `client` replaces the OpenAI client (benchmarks).
     """
     if not os.path.exists(vtt_file_path):
         raise FileNotFoundError(f"File not found: {vtt_file_path}")
 
+    from usage import estimate_job
+    from scheduler import get_scheduler
+    from dedupe import build_units
+
     print("Parsing subtitles...")
     try:
-        captions = webvtt.read(vtt_file_path)
-    except Exception:
-        # Fallback if webvtt is not installed or fails, but we expect it to be installed
-        # For now let's assume it works or fail hard so user installs deps
-        print("Error reading VTT file. Please ensure 'webvtt-py' is installed.")
+        store = CueStore.from_vtt(vtt_file_path, keep=_clean_text)
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error reading VTT file: {e}")
         return None
 
-    client = OpenAI(api_key=api_key, base_url=base_url)
-
-    translated_content = []
-    
-    # Prepare batches to reduce API calls and improve context
-    batch_size = 20
-    caption_batch = []
-    
-    # 用于去重的集合
-    seen_texts = set()
-    
-    total_captions = len(captions)
+    canonical, unit_of = build_units(store)
+    total_captions = store.raw_count
+    unit_count = len(canonical)
     print(f"原始字幕行数: {total_captions}")
 
-    for i, caption in enumerate(captions):
-        # 清理文本：移除换行符和多余空格
-        text = caption.text.replace('\n', ' ').strip()
-        
-        # 跳过空行或仅包含时间戳的行
-        if not text or text.strip() == '':
-            continue
-            
-        # 跳过纯时间戳行（YouTube VTT经常有这种重复）
-        if text.replace('.', '').replace(':', '').replace(' ', '').isdigit():
+    def unit_text(unit):
+        return store.text(canonical[unit])
+
+    # unit id -> 译文在 translations 中的 id，-1 表示还在翻译
+    translations = TextTable()
+    translation_of = array("l", [-1]) * unit_count
+    # 上次翻译过的单元直接复用，只翻译新增或改动的单元
+    pending = array("l")
+    for unit in range(unit_count):
+        previous = memory.lookup(unit_text(unit)) if memory is not None else None
+        if previous is None:
+            pending.append(unit)
+        else:
+            translation_of[unit], _ = translations.intern(previous)
+    reused = unit_count - len(pending)
+    if memory is not None:
+        print(f"复用上次译文 {reused} 行，需要翻译 {len(pending)} 行")
+
+    # 预估花费，超出预算时在发出任何请求前拒绝或截断
+    estimate = estimate_job((unit_text(unit) for unit in pending), BATCH_SIZE, SYSTEM_PROMPT)
+    print(f"预计 {estimate['batches']} 个批次，约 {estimate['prompt_tokens'] + estimate['completion_tokens']} tokens，${estimate['cost']:.4f}")
+    if usage is not None:
+        usage.estimate = estimate
+    allowed = budget.preflight(estimate) if budget is not None else len(pending)
+    # 预检时超出预算被截断的单元
+    truncated_id, _ = translations.intern("[超出预算，未翻译]")
+    for unit in pending[allowed:]:
+        translation_of[unit] = truncated_id
+
+    if client is None and allowed:
+        # 重量级依赖延迟到首次翻译时加载，缩短冷启动
+        from cassette import active_cassette
+        from hedging import HEDGE_ENABLED, hedged
+        cassette = active_cassette()
+        if cassette is not None:
+            # 录制/回放翻译响应（见 cassette.py），回放时不需要网络和 openai 包
+            client = cassette.openai_client(api_key, base_url)
+        else:
+            from openai import OpenAI
+            client = OpenAI(api_key=api_key, base_url=base_url)
+        if HEDGE_ENABLED:
+            # 慢批次超过自适应阈值时发送对冲请求，压缩长尾耗时
+            client = hedged(client, api_key, usage)
+
+    # 添加处理统计
+    out.write(f"<!-- 处理统计：原始字幕 {total_captions} 行，去重后 {unit_count} 行 -->")
+
+    # 各批次交给全局调度器，与其他任务公平地共享并发槽位；
+    # 只保留有限个在途批次，写出一个再提交一个。单元按首次出现顺序
+    # 编号，所以按字幕顺序写出时只需等待下一个在途批次
+    scheduler = get_scheduler()
+    job_id = uuid.uuid4().hex
+    batches = _iter_batches(pending[:allowed], unit_text)
+    in_flight = deque()
+    done = 0
+    failed = 0
+
+    def submit_next():
+        batch = next(batches, None)
+        if batch is not None:
+            batch_units, caption_batch = batch
+            future = scheduler.submit(job_id, priority, _run_batch, client, caption_batch, usage, budget, glossary)
+            in_flight.append((batch_units, caption_batch, future))
+
+    def collect_next():
+        nonlocal done, failed
+        batch_units, caption_batch, future = in_flight.popleft()
+        print(f"Translating batch {done + 1} to {done + len(caption_batch)}...")
+        done += len(caption_batch)
+        try:
+            translated_block = future.result()
+            if translated_block is None:
+                # 执行过程中累计用量超出预算：保留原文，不再请求
+                lines = ["[超出预算，未翻译]"] * len(caption_batch)
+                failed += len(caption_batch)
+                if usage is not None:
+                    usage.truncated_lines += len(caption_batch)
+            else:
+                lines = [translated_block[j] if j < len(translated_block) else "[翻译缺失]"
+                         for j in range(len(caption_batch))]
+                if memory is not None:
+                    for orig, trans in zip(caption_batch, lines):
+                        if trans != "[翻译缺失]":
+                            memory.record(orig, trans)
+        except Exception as e:
+            print(f"Error translating batch: {e}")
+            # Fallback: keep original only
+            lines = ["[Translation Failed]"] * len(caption_batch)
+            failed += len(caption_batch)
+        for unit, line in zip(batch_units, lines):
+            translation_of[unit], _ = translations.intern(line)
+        submit_next()
+
+    for _ in range(MAX_IN_FLIGHT_BATCHES):
+        submit_next()
+
+    written = 0
+
+    def write_entry(start_ms, unit, text_id):
+        nonlocal written
+        while translation_of[unit] < 0:
+            collect_next()
+        # 原文写每条字幕自己的文本，只有译文在同一单元的各处共用
+        orig, trans = store.text(text_id), translations.text(translation_of[unit])
+        out.write(f"\n> {orig}\n{trans}\n")
+        if sink is not None:
+            sink(start_ms, orig, trans)
+        written += 1
+
+    # 没有语音内容的行（[Music] 等）跳过；紧接着重复上一行的滚动字幕只写一次，
+    # 原文取这一串中最完整的版本
+    entry = None
+    for start_ms, _, text_id in store.iter_cues():
+        unit = unit_of[text_id]
+        if unit < 0:
             continue
-            
-        # 去重：跳过已经处理过的相同文本
-        if text in seen_texts:
+        if entry is not None and entry[1] == unit:
+            if len(store.text(text_id)) > len(store.text(entry[2])):
+                entry = (entry[0], unit, text_id)
             continue
-        seen_texts.add(text)
-        
-        caption_batch.append(text)
-
-        if len(caption_batch) >= batch_size or i == total_captions - 1:
-            # Process batch
-            print(f"Translating batch {i - len(caption_batch) + 2} to {i + 1}...")
-            
-            original_text_block = "\n".join(caption_batch)
-            
-            try:
-                response = client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[
-                        {"role": "system", "content": "You are a professional translator. Translate the following subtitle lines into Simplified Chinese. Maintain the line-by-line structure. Output ONLY the translated lines, one per original line. Do not add any intro or outro."},
-                        {"role": "user", "content": original_text_block}
-                    ],
-                    stream=False
-                )
-                
-                translated_response = response.choices[0].message.content.strip()
-                translated_block = translated_response.split('\n')
-                
-                # 清理翻译结果：移除空行
-                translated_block = [line.strip() for line in translated_block if line.strip()]
-                
-                # Align translations with originals
-                # 改进的匹配逻辑，处理行数不匹配的情况
-                if len(translated_block) != len(caption_batch):
-                    print(f"⚠️  警告: 批次行数不匹配 (原文: {len(caption_batch)}, 翻译: {len(translated_block)})")
-                    
-                    # 如果翻译行数较少，重复使用最后一行
-                    if len(translated_block) < len(caption_batch):
-                        while len(translated_block) < len(caption_batch):
-                            translated_block.append(translated_block[-1] if translated_block else "[翻译缺失]")
-                    
-                    # 如果翻译行数较多，截取前面的行
-                    elif len(translated_block) > len(caption_batch):
-                        translated_block = translated_block[:len(caption_batch)]
-                
-                # 添加处理后的内容
-                for j, orig in enumerate(caption_batch):
-                    trans = translated_block[j] if j < len(translated_block) else "[翻译缺失]"
-                    translated_content.append(f"> {orig}\n{trans}\n")
-
-            except Exception as e:
-                print(f"Error translating batch: {e}")
-                # Fallback: keep original only
-                for orig in caption_batch:
-                    translated_content.append(f"> {orig}\n[Translation Failed]\n")
-            
-            caption_batch = [] # Reset batch
+        if entry is not None:
+            write_entry(*entry)
+        entry = (start_ms, unit, text_id)
+    if entry is not None:
+        write_entry(*entry)
+    if usage is not None:
+        usage.truncated_lines += len(pending) - allowed
 
-    # 添加处理统计
-    final_content = []
-    final_content.append(f"<!-- 处理统计：原始字幕 {total_captions} 行，去重后 {len(seen_texts)} 行 -->")
-    final_content.extend(translated_content)
-    
-    print(f"✅ 翻译完成！处理了 {len(seen_texts)} 行字幕（原始 {total_captions} 行，去重 {total_captions - len(seen_texts)} 行）")
-    return "\n".join(final_content)
+    print(f"✅ 翻译完成！翻译了 {unit_count} 个单元，写出 {written} 行（原始 {total_captions} 行）")
+    if usage is not None:
+        print(f"💰 实际用量: {usage.prompt_tokens} + {usage.completion_tokens} tokens（缓存命中 {usage.cache_hit_tokens}），${usage.cost:.4f}")
+    return {'captions': total_captions, 'unique': unit_count, 'reused': reused,
+            'failed': failed + len(pending) - allowed}
+
+def translate_subtitles(vtt_file_path, api_key, base_url="https://api.deepseek.com", usage=None, budget=None,
+                        priority="interactive", glossary=None):
+    """
+    Parses a VTT file, translates the content using DeepSeek API,
+    and returns a formatted string (Original + Translation).
+
+    `usage` (usage.JobUsage) collects token counts and cost per batch;
+    `budget` (usage.Budget) is checked against a pre-flight estimate before
+    any request is sent and again after every batch. Batches run on the
+    shared scheduler in the given `priority` class ('interactive' or 'bulk').
+    `glossary` (glossary.Glossary) pins the rendering of channel terms.
+    Prefer write_translation for long videos; this keeps the whole result
+    in memory.
+    """
+    buffer = io.StringIO()
+    if write_translation(vtt_file_path, buffer, api_key, base_url, usage, budget, priority,
+                         glossary=glossary) is None:
+        return None
+    return buffer.getvalue()
 
 if __name__ == "__main__":
     # Test
@@ -0,0 +1,350 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from contextlib import closing
+
+import metrics
+
+# 价格：美元 / 百万 tokens（DeepSeek deepseek-chat 官方定价，可通过环境变量覆盖）
+PRICE_INPUT_CACHE_HIT = float(os.environ.get("PRICE_INPUT_CACHE_HIT", 0.028))
+PRICE_INPUT_CACHE_MISS = float(os.environ.get("PRICE_INPUT_CACHE_MISS", 0.28))
+PRICE_OUTPUT = float(os.environ.get("PRICE_OUTPUT", 0.42))
+
+# 预算（0 表示不限制）
+JOB_MAX_COST = float(os.environ.get("JOB_MAX_COST", 0))
+JOB_MAX_TOKENS = int(os.environ.get("JOB_MAX_TOKENS", 0))
+KEY_DAILY_MAX_COST = float(os.environ.get("KEY_DAILY_MAX_COST", 0))
+# 超出预算时的处理：abort 直接拒绝；truncate 只翻译预算内的前若干行
+BUDGET_POLICY = os.environ.get("BUDGET_POLICY", "abort")
+
+# 译文 tokens 相对原文 tokens 的估算比例
+OUTPUT_TOKEN_RATIO = float(os.environ.get("OUTPUT_TOKEN_RATIO", 1.2))
+
+metrics.describe("translator_tokens_total", "Tokens used by subtitle translation, by kind")
+metrics.describe("translator_cost_usd_total", "Estimated USD spent on subtitle translation")
+metrics.describe("translator_requests_total", "Translation API requests")
+metrics.describe("budget_rejections_total", "Jobs rejected or truncated by a budget")
+
+
+class BudgetExceeded(Exception):
+    """A job would exceed its token/cost budget. `status` is used for the HTTP response."""
+
+    status = 402
+
+
+def key_fingerprint(api_key):
+    """Never store API keys; usage is grouped by a short hash instead."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def estimate_tokens(text):
+    """
+    Rough DeepSeek token estimate without a tokenizer: about 0.6 tokens per
+    CJK character and 0.3 per other character.
+    """
+    cjk = sum(1 for c in text if '\u3000' <= c <= '\u9fff' or '\uff00' <= c <= '\uffef')
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+def cost_of(prompt_cache_hit, prompt_cache_miss, completion):
+    return (prompt_cache_hit * PRICE_INPUT_CACHE_HIT
+            + prompt_cache_miss * PRICE_INPUT_CACHE_MISS
+            + completion * PRICE_OUTPUT) / 1e6
+
+
+def estimate_job(lines, batch_size, system_prompt):
+    """
+    Pre-flight estimate for translating `lines` (any iterable) in batches of
+    `batch_size`. Returns a dict with per-line prompt token counts for
+    budget truncation.
+    """
+    system_tokens = estimate_tokens(system_prompt)
+    line_tokens = array('l', (estimate_tokens(line) + 1 for line in lines))
+    batches = (len(line_tokens) + batch_size - 1) // batch_size
+    prompt = sum(line_tokens) + batches * system_tokens
+    completion = int(sum(line_tokens) * OUTPUT_TOKEN_RATIO)
+    return {
+        'lines': len(line_tokens),
+        'batches': batches,
+        'batch_size': batch_size,
+        'prompt_tokens': prompt,
+        'completion_tokens': completion,
+        # 系统提示词在后续批次大概率命中缓存，预估时保守地按未命中计算
+        'cost': round(cost_of(0, prompt, completion), 6),
+        'line_tokens': line_tokens,
+        'system_tokens': system_tokens,
+    }
+
+
+class JobUsage:
+    """Accumulates actual usage of one translation job, batch by batch."""
+
+    def __init__(self, api_key=None):
+        self.key_fp = key_fingerprint(api_key) if api_key else None
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hit_tokens = 0
+        self.cost = 0.0
+        self.estimate = None
+        self.truncated_lines = 0
+        self._lock = threading.Lock()
+        # 写入账本后设置；之后才返回的用量直接计入账本
+        self._ledger = None
+
+    def record(self, usage):
+        """Records an OpenAI-compatible `response.usage` object (may be None)."""
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        # DeepSeek 返回 prompt_cache_hit_tokens；OpenAI 兼容实现放在 prompt_tokens_details.cached_tokens
+        hit = getattr(usage, "prompt_cache_hit_tokens", None)
+        if hit is None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            hit = getattr(details, "cached_tokens", 0) if details else 0
+        hit = hit or 0
+        cost = cost_of(hit, max(prompt - hit, 0), completion)
+
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+            self.cache_hit_tokens += hit
+            self.cost += cost
+            ledger = self._ledger
+        if ledger is not None:
+            # 任务已经结算（例如落败的对冲请求在任务结束后才返回），这部分用量单独补记
+            ledger.record_late(self.key_fp, prompt, completion, hit, cost)
+
+        metrics.inc("translator_requests_total")
+        metrics.inc("translator_tokens_total", prompt - hit, kind="prompt_cache_miss")
+        metrics.inc("translator_tokens_total", hit, kind="prompt_cache_hit")
+        metrics.inc("translator_tokens_total", completion, kind="completion")
+        metrics.inc("translator_cost_usd_total", cost)
+
+    def settle(self, ledger):
+        """
+        Marks the job as written to `ledger` and returns its totals
+        (prompt, completion, cache hit tokens, cost). Usage recorded after
+        this goes straight to the ledger.
+        """
+        with self._lock:
+            self._ledger = ledger
+            return self.prompt_tokens, self.completion_tokens, self.cache_hit_tokens, self.cost
+
+    def over_budget(self, budget):
+        if budget is None:
+            return False
+        if budget.max_cost and self.cost > budget.max_cost:
+            return True
+        if budget.max_tokens and self.prompt_tokens + self.completion_tokens > budget.max_tokens:
+            return True
+        return False
+
+    def to_dict(self):
+        result = {
+            'requests': self.requests,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'prompt_cache_hit_tokens': self.cache_hit_tokens,
+            'cost_usd': round(self.cost, 6),
+        }
+        if self.estimate:
+            result['estimate'] = {k: v for k, v in self.estimate.items() if k not in ('line_tokens', 'system_tokens')}
+        if self.truncated_lines:
+            result['truncated_lines'] = self.truncated_lines
+        return result
+
+
+class Budget:
+    """
+    Limits for one job. With a `ledger`, pre-flight also checks the daily
+    budget of the API key `key_fp` and reserves the job's estimated cost
+    there (see UsageLedger.reserve); `reserved_cost` is what was reserved.
+    """
+
+    def __init__(self, max_cost=JOB_MAX_COST, max_tokens=JOB_MAX_TOKENS, policy=BUDGET_POLICY,
+                 ledger=None, key_fp=None):
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.policy = policy
+        self.ledger = ledger
+        self.key_fp = key_fp
+        self.reserved_cost = 0.0
+
+    def limit_cost(self, remaining):
+        """Caps the job at `remaining` dollars (what is left of the key's daily budget)."""
+        self.max_cost = min(self.max_cost, remaining) if self.max_cost else remaining
+
+    def preflight(self, estimate):
+        """
+        Returns how many lines may be translated. Raises BudgetExceeded when
+        the policy is 'abort' (or nothing fits) and the estimate is over budget.
+        """
+        if self.ledger is not None:
+            return self.ledger.reserve(self, estimate)
+        return self.check(estimate)
+
+    def check(self, estimate):
+        """preflight without the key's daily budget."""
+        fits_cost = not self.max_cost or estimate['cost'] <= self.max_cost
+        fits_tokens = not self.max_tokens or estimate['prompt_tokens'] + estimate['completion_tokens'] <= self.max_tokens
+        if fits_cost and fits_tokens:
+            return estimate['lines']
+
+        allowed = self._lines_within_budget(estimate)
+        metrics.inc("budget_rejections_total", policy=self.policy)
+        if self.policy != 'truncate' or allowed == 0:
+            raise BudgetExceeded(
+                f"预计花费 ${estimate['cost']:.4f} / {estimate['prompt_tokens'] + estimate['completion_tokens']} tokens，"
+                f"超出预算（${self.max_cost or '∞'} / {self.max_tokens or '∞'} tokens）"
+            )
+        print(f"⚠️  超出预算，只翻译前 {allowed}/{estimate['lines']} 行")
+        return allowed
+
+    @staticmethod
+    def estimated_cost(estimate, lines):
+        """Pre-flight cost of translating only the first `lines` lines of `estimate`."""
+        if lines >= estimate['lines']:
+            return estimate['cost']
+        batch_size = estimate['batch_size']
+        prompt = completion = 0
+        for i, tokens in enumerate(estimate['line_tokens'][:lines]):
+            if i % batch_size == 0:
+                prompt += estimate['system_tokens']
+            prompt += tokens
+            completion += tokens * OUTPUT_TOKEN_RATIO
+        return cost_of(0, prompt, completion)
+
+    def _lines_within_budget(self, estimate):
+        batch_size = estimate['batch_size']
+        prompt = completion = 0
+        for i, tokens in enumerate(estimate['line_tokens']):
+            if i % batch_size == 0:
+                prompt += estimate['system_tokens']
+            prompt += tokens
+            completion += tokens * OUTPUT_TOKEN_RATIO
+            if self.max_cost and cost_of(0, prompt, completion) > self.max_cost:
+                return i
+            if self.max_tokens and prompt + completion > self.max_tokens:
+                return i
+        return len(estimate['line_tokens'])
+
+
+class UsageLedger:
+    """
+    Per-key daily usage totals in a SQLite file shared by all workers.
+
+    Running jobs hold a reservation of their estimated cost so concurrent
+    pre-flights of the same key see each other; add() settles it to the
+    actual usage when the job ends.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                " key_fp TEXT NOT NULL, day TEXT NOT NULL, jobs INTEGER NOT NULL DEFAULT 0,"
+                " prompt_tokens INTEGER NOT NULL DEFAULT 0, completion_tokens INTEGER NOT NULL DEFAULT 0,"
+                " cache_hit_tokens INTEGER NOT NULL DEFAULT 0, cost REAL NOT NULL DEFAULT 0,"
+                " reserved REAL NOT NULL DEFAULT 0, PRIMARY KEY (key_fp, day))"
+            )
+            # 早期版本的数据库没有 reserved 列
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(usage)")]
+            if "reserved" not in columns:
+                conn.execute("ALTER TABLE usage ADD COLUMN reserved REAL NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _today():
+        return time.strftime("%Y-%m-%d", time.gmtime())
+
+    def _committed(self, conn, key_fp):
+        # 已花费加上运行中任务的预留
+        row = conn.execute(
+            "SELECT cost + reserved FROM usage WHERE key_fp = ? AND day = ?", (key_fp, self._today())
+        ).fetchone()
+        return row[0] if row else 0.0
+
+    def _remaining(self, conn, key_fp):
+        remaining = max(KEY_DAILY_MAX_COST - self._committed(conn, key_fp), 0.0)
+        if remaining <= 0:
+            metrics.inc("budget_rejections_total", policy="key_daily")
+            raise BudgetExceeded("该 API 密钥今日预算已用完")
+        return remaining
+
+    def spent_today(self, key_fp):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT cost FROM usage WHERE key_fp = ? AND day = ?", (key_fp, self._today())
+            ).fetchone()
+        return row[0] if row else 0.0
+
+    def budget_for(self, api_key, max_cost=None):
+        """Builds the Budget for a new job of `api_key`, honouring a per-request cap."""
+        job_cost = JOB_MAX_COST
+        if max_cost:
+            job_cost = min(job_cost, max_cost) if job_cost else max_cost
+        if not KEY_DAILY_MAX_COST:
+            return Budget(max_cost=job_cost)
+        key_fp = key_fingerprint(api_key)
+        # 今日预算已用完（含运行中任务的预留）时在下载字幕前就拒绝
+        with closing(self._connect()) as conn:
+            self._remaining(conn, key_fp)
+        return Budget(max_cost=job_cost, ledger=self, key_fp=key_fp)
+
+    def reserve(self, budget, estimate):
+        """
+        Pre-flight against the key's daily budget: inside one write
+        transaction, caps `budget` at what is left after spent and reserved
+        cost, runs Budget.check and reserves the estimated cost of the
+        allowed lines. Returns the number of allowed lines.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                budget.limit_cost(self._remaining(conn, budget.key_fp))
+                allowed = budget.check(estimate)
+                reserved = Budget.estimated_cost(estimate, allowed)
+                conn.execute(
+                    "INSERT INTO usage (key_fp, day, reserved) VALUES (?, ?, ?)"
+                    " ON CONFLICT (key_fp, day) DO UPDATE SET reserved = reserved + excluded.reserved",
+                    (budget.key_fp, self._today(), reserved)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        budget.reserved_cost = reserved
+        return allowed
+
+    def add(self, job_usage, reserved_cost=0.0):
+        """Records a finished job and releases the `reserved_cost` it held."""
+        if not job_usage.key_fp:
+            return
+        self._add(job_usage.key_fp, 1, *job_usage.settle(self), reserved_cost)
+
+    def record_late(self, key_fp, prompt_tokens, completion_tokens, cache_hit_tokens, cost):
+        """Adds usage that arrived after its job was recorded."""
+        self._add(key_fp, 0, prompt_tokens, completion_tokens, cache_hit_tokens, cost, 0.0)
+
+    def _add(self, key_fp, jobs, prompt_tokens, completion_tokens, cache_hit_tokens, cost, reserved_cost):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO usage (key_fp, day, jobs, prompt_tokens, completion_tokens, cache_hit_tokens, cost)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (key_fp, day) DO UPDATE SET jobs = jobs + excluded.jobs,"
+                " prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                " completion_tokens = completion_tokens + excluded.completion_tokens,"
+                " cache_hit_tokens = cache_hit_tokens + excluded.cache_hit_tokens,"
+                " cost = cost + excluded.cost, reserved = MAX(reserved - ?, 0)",
+                (key_fp, self._today(), jobs, prompt_tokens, completion_tokens, cache_hit_tokens, cost,
+                 reserved_cost)
+            )
@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import time
+import shutil
+import secrets
+import threading
+
+# 配额配置（可通过环境变量覆盖）
+WORKSPACE_MAX_BYTES = int(os.environ.get("WORKSPACE_MAX_BYTES", 512 * 1024 * 1024))
+WORKSPACE_MAX_AGE = int(os.environ.get("WORKSPACE_MAX_AGE", 6 * 3600))
+WORKSPACE_DELIVERED_TTL = int(os.environ.get("WORKSPACE_DELIVERED_TTL", 600))
+WORKSPACE_SWEEP_INTERVAL = int(os.environ.get("WORKSPACE_SWEEP_INTERVAL", 30))
+
+MANIFEST_NAME = "job.json"
+ACTIVE_MARKER = ".active"
+
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+def _new_id(nbytes=12):
+    return secrets.token_urlsafe(nbytes)
+
+
+def is_valid_id(value):
+    """Job and file ids are opaque url-safe tokens; reject anything else."""
+    return bool(value) and bool(_ID_RE.match(value))
+
+
+class Workspace:
+    """
+    A private directory for one job. Scratch files (cookies, VTTs) live here
+    next to the published outputs; only published files survive finish().
+    """
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+        self.path = os.path.join(manager.root, job_id)
+
+    def path_for(self, name):
+        return os.path.join(self.path, os.path.basename(name))
+
+    def _read_manifest(self):
+        return self.manager._read_manifest(self.path)
+
+    def _write_manifest(self, manifest):
+        tmp_path = os.path.join(self.path, MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_NAME))
+
+    def publish(self, name, download_name=None, mimetype="application/octet-stream"):
+        """
+        Registers a file in this workspace for download and returns its
+        opaque file id. The file must already exist under path_for(name).
+        """
+        name = os.path.basename(name)
+        if not os.path.exists(self.path_for(name)):
+            raise FileNotFoundError(f"File not found: {name}")
+        manifest = self._read_manifest()
+        file_id = _new_id(8)
+        manifest.setdefault("files", {})[file_id] = {
+            "name": name,
+            "download_name": download_name or name,
+            "mimetype": mimetype,
+        }
+        self._write_manifest(manifest)
+        return file_id
+
+    def finish(self):
+        """
+        Ends the job: deletes scratch files, keeps published outputs until
+        they are delivered or evicted. A job with no outputs is removed.
+        """
+        manifest = self._read_manifest()
+        keep = {entry["name"] for entry in manifest.get("files", {}).values()}
+        if not keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+
+        keep.add(MANIFEST_NAME)
+        for name in os.listdir(self.path):
+            if name in keep:
+                continue
+            full_path = os.path.join(self.path, name)
+            if os.path.isdir(full_path):
+                shutil.rmtree(full_path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(full_path)
+                except OSError:
+                    pass
+        os.utime(self.path, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+        return False
+
+
+class WorkspaceManager:
+    """
+    Hands out per-job directories under `root` and keeps the total size and
+    age of that tree bounded. Eviction is least-recently-used by directory
+    mtime, which is bumped on every create/finish/download.
+    """
+
+    def __init__(self, root, max_bytes=WORKSPACE_MAX_BYTES, max_age=WORKSPACE_MAX_AGE,
+                 delivered_ttl=WORKSPACE_DELIVERED_TTL, sweep_interval=WORKSPACE_SWEEP_INTERVAL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.delivered_ttl = delivered_ttl
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _read_manifest(self, job_path):
+        try:
+            with open(os.path.join(job_path, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def create(self):
+        self.maybe_sweep()
+        job_id = _new_id()
+        workspace = Workspace(self, job_id)
+        os.makedirs(workspace.path)
+        open(os.path.join(workspace.path, ACTIVE_MARKER), "w").close()
+        workspace._write_manifest({"created": time.time(), "files": {}})
+        return workspace
+
+    def resolve_download(self, job_id, file_id):
+        """
+        Returns (path, download_name, mimetype) for a published file, or None.
+        Marks the job as delivered so it expires after `delivered_ttl`.
+        """
+        if not is_valid_id(job_id) or not is_valid_id(file_id):
+            return None
+        job_path = os.path.join(self.root, job_id)
+        manifest = self._read_manifest(job_path)
+        entry = manifest.get("files", {}).get(file_id)
+        if not entry:
+            return None
+        file_path = os.path.join(job_path, os.path.basename(entry["name"]))
+        if not os.path.exists(file_path):
+            return None
+
+        if not manifest.get("delivered"):
+            manifest["delivered"] = time.time()
+            Workspace(self, job_id)._write_manifest(manifest)
+        try:
+            os.utime(job_path, None)
+        except OSError:
+            pass
+        return file_path, entry["download_name"], entry["mimetype"]
+
+    def maybe_sweep(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        self.sweep(now)
+
+    def sweep(self, now=None):
+        """
+        Removes expired and delivered jobs, then evicts the least recently
+        used finished jobs until the tree fits in `max_bytes`.
+        """
+        now = now or time.time()
+        jobs = []
+        for job_id in os.listdir(self.root):
+            job_path = os.path.join(self.root, job_id)
+            if not os.path.isdir(job_path):
+                continue
+            try:
+                last_used = os.path.getmtime(job_path)
+            except OSError:
+                continue
+            manifest = self._read_manifest(job_path)
+            created = manifest.get("created", last_used)
+            delivered = manifest.get("delivered")
+            active = os.path.exists(os.path.join(job_path, ACTIVE_MARKER))
+
+            if now - created > self.max_age or (delivered and now - delivered > self.delivered_ttl):
+                shutil.rmtree(job_path, ignore_errors=True)
+                continue
+            jobs.append((last_used, active, job_path, _dir_size(job_path)))
+
+        total = sum(size for _, _, _, size in jobs)
+        if total <= self.max_bytes:
+            return
+        for _, active, job_path, size in sorted(jobs):
+            if total <= self.max_bytes:
+                break
+            if active:
+                continue
+            shutil.rmtree(job_path, ignore_errors=True)
+            total -= size
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total